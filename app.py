@@ -10,6 +10,7 @@ from wtforms.validators import Required
 
 from itertools import groupby
 from bot import IndraBot
+from profiling import profile_call
 
 
 class ExampleForm(Form):
@@ -49,7 +50,13 @@ def create_app(configfile=None):
             question = None
         kwargs = {'form': form}
         if question:
-            stmts = bot.handle_question(question)
+            # Adding ?profile=1 to the URL profiles answering the question
+            if request.args.get('profile', '0') not in ('', '0', 'false'):
+                stmts, summary = profile_call(bot.handle_question, question,
+                                              use_cache=False)
+                kwargs['profile'] = summary
+            else:
+                stmts = bot.handle_question(question)
             if stmts:
                 resp_html = format_stmts(stmts)
                 kwargs['response'] = resp_html
@@ -2,22 +2,94 @@ import re
 import nltk
 import logging
 import requests
+import itertools
+import functools
+import threading
+from collections import defaultdict
+from concurrent import futures
 from fuzzywuzzy import fuzz
 from indra.statements import Agent
 from indra.sources import indra_db_rest
 from indra.databases import hgnc_client
 from indra.tools import expand_families
+from grounding import GroundingIndex
+from upstream import Deadline, CircuitBreaker, TokenBucket, TTLCache, \
+    UpstreamUnavailable
 
 
 logger = logging.getLogger('indrabot.bot')
 
 
 EV_LIMIT = 1
+# Settings for querying the members of families in parallel
+EXPAND_MAX_WORKERS = 4
+EXPAND_MAX_QUERIES = 16
+EXPAND_TIMEOUT = 20
+# Settings for answering alternative interpretations of a question
+SPECULATE_MAX_WORKERS = 4
+ALTERNATES_CACHE_SIZE = 100
+ALTERNATES_TTL = 600
+# Settings for caching complete answers and Gilda groundings
+RESPONSE_CACHE_SIZE = 1000
+RESPONSE_TTL = 3600
+GILDA_CACHE_SIZE = 10000
+GILDA_CACHE_TTL = 86400
+# Time budgets in seconds for answering a question, for calling Gilda and
+# for a single INDRA DB query
+QUESTION_TIMEOUT = 60
+GILDA_TIMEOUT = 5
+DB_TIMEOUT = 30
+
+gilda_breaker = CircuitBreaker('Gilda')
+db_breaker = CircuitBreaker('INDRA DB')
+gilda_limiter = TokenBucket('Gilda', rate=10, capacity=20)
+db_limiter = TokenBucket('INDRA DB', rate=4, capacity=8)
 
 
 class IndraBot(object):
-    def __init__(self):
+    """Answers natural language questions with INDRA Statements.
+
+    Parameters
+    ----------
+    expand_members : Optional[bool]
+        If True, entities grounded to FamPlex families or complexes are
+        also queried in terms of their specific members and the results
+        are merged into a single answer. Default: False
+    speculate : Optional[bool]
+        If True, when a question matches several distinct templates, the
+        alternative interpretations are answered in the background while
+        the first one is answered, and they are kept for a while in case
+        the user asks about one of them next. Default: False
+    cache_responses : Optional[bool]
+        If True, complete answers are cached and questions with the same
+        canonical key are answered from the cache. Default: True
+
+    Attributes
+    ----------
+    responses : upstream.TTLCache
+        Complete answers keyed by the canonical key of the question they
+        answer, see get_canonical_key.
+    cache_stats : dict
+        The number of response cache hits and misses for each type of
+        question, keyed by the name of the function answering it.
+    """
+    def __init__(self, expand_members=False, speculate=False,
+                 cache_responses=True):
         self.templates = self.make_templates()
+        self.expand_members = expand_members
+        self.speculate = speculate
+        self.cache_responses = cache_responses
+        # Alternates are kept as (future, deadline) tuples, and those that
+        # are evicted before they are used aren't needed
+        self.alternates = TTLCache(ALTERNATES_CACHE_SIZE, ALTERNATES_TTL,
+                                   on_evict=lambda key, alternate:
+                                   cancel_alternate(alternate))
+        self.responses = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_TTL)
+        self.cache_stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        self._stats_lock = threading.Lock()
+        self._alternates_lock = threading.Lock()
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=SPECULATE_MAX_WORKERS) if speculate else None
 
     @staticmethod
     def make_templates():
@@ -134,7 +206,46 @@ class IndraBot(object):
         text = text.strip()
         return text
 
-    def handle_question(self, question):
+    def handle_question(self, question, expand_members=None,
+                        timeout=QUESTION_TIMEOUT, suggest=True,
+                        speculate=None, use_cache=None):
+        """Return an answer to a question.
+
+        If the answer can't be completed within the timeout, a partial
+        answer is returned, for instance, without suggestions or with only
+        the statements found so far, and its 'partial' entry is set.
+
+        Parameters
+        ----------
+        question : str
+            The question to answer.
+        expand_members : Optional[bool]
+            If given, overrides the bot-level setting of whether families
+            should be expanded to their members when querying.
+        timeout : Optional[float]
+            The number of seconds within which the question should be
+            answered. If None, there is no time limit.
+            Default: QUESTION_TIMEOUT
+        suggest : Optional[bool]
+            If False, no suggestions for related questions are made, for
+            instance, to save work under load. Default: True
+        speculate : Optional[bool]
+            If given, overrides the bot-level setting of whether
+            alternative interpretations of the question are answered in
+            the background. This only has an effect if the bot was
+            created with speculate=True.
+        use_cache : Optional[bool]
+            If given, overrides the bot-level setting of whether the
+            response cache is used, for instance, to profile answering
+            a question that was answered before.
+        """
+        deadline = Deadline(timeout)
+        if expand_members is None:
+            expand_members = self.expand_members
+        if speculate is None:
+            speculate = self.speculate
+        if use_cache is None:
+            use_cache = self.cache_responses
         # First sanitize the string to prepare it for matching
         question = self.sanitize(question)
         # Next, collect all the patterns that match
@@ -146,33 +257,154 @@ class IndraBot(object):
                 matches.append((action, args))
         print('matches', matches)
 
-        # If we have multiple matches, we ask the first one
-        # (possibly ask for clarification)
-        if len(matches) > 1:
-            ret = self.respond(*matches[0])
-            suggestions = suggest_relevant_relations(ret['groundings'])
-            if suggestions:
-                ret['suggestion'] = suggestions
-            return ret
-            #return self.ask_clarification(matches)
         # If we have no matches, we try to find a similar question
         # and ask for clarification
-        elif not matches:
+        if not matches:
             return {'question': self.find_fuzzy_clarify(question)}
-        # Otherwise we respond with the first match
-        else:
-            ret = self.respond(*matches[0])
-            suggestions = suggest_relevant_relations(ret['groundings'])
-            if suggestions:
-                ret['suggestion'] = suggestions
-            print(ret)
+        # Otherwise we respond with the first match. If we have multiple
+        # matches, we could also ask for clarification here.
+        #return self.ask_clarification(matches)
+        # Each entity is only grounded once, and the groundings are passed
+        # on to the function answering the question
+        action, args = matches[0]
+        groundings = ground_entities(args, deadline=deadline)
+        key = self.get_canonical_key(action, args, groundings, expand_members)
+        # Paraphrases of a question that was answered before share its
+        # canonical key so we can answer them from the cache
+        if use_cache:
+            cached = self.responses.get(key)
+            self.record_cache_use(key, cached is not None)
+            if cached is not None:
+                logger.info('Answering %s from the response cache'
+                            % str(key))
+                return dict(cached)
+        pending = []
+        if speculate and self._executor and len(matches) > 1:
+            pending = self.start_alternates(key, matches[1:], groundings,
+                                            expand_members, deadline)
+        ret = self.respond_intent(key, action, args, groundings,
+                                  expand_members, deadline)
+        if deadline.expired():
+            # Alternates that haven't started can't finish in time either
+            for future in pending:
+                future.cancel()
+            logger.info('Out of time, skipping suggestions.')
+            ret['partial'] = True
             return ret
-
-    def respond(self, action, args):
+        if not suggest:
+            return ret
+        suggestions = suggest_relevant_relations(ret['groundings'],
+                                                 expanded=expand_members,
+                                                 deadline=deadline)
+        if suggestions:
+            ret['suggestion'] = suggestions
+        # Only complete answers are cached
+        if use_cache and not ret.get('partial') and not deadline.expired():
+            self.responses.set(key, dict(ret))
+        print(ret)
+        return ret
+
+    def respond(self, action, args, expand=False, deadline=None,
+                groundings=None):
         print('args', args)
-        stmts = action(*args)
+        stmts = action(*args, expand=expand, deadline=deadline,
+                       groundings=groundings)
         return stmts
 
+    @staticmethod
+    def get_canonical_key(action, args, groundings, expand=False):
+        """Return a key identifying what a matched question asks for.
+
+        The key consists of the name of the function answering the
+        question, the statement type implied by its verb, if any, the
+        groundings of its arguments and whether families are expanded.
+        Paraphrases like "does MEK regulate ERK" and "can mek regulate
+        ERK" therefore get the same key.
+        """
+        func = getattr(action, 'func', action)
+        keywords = getattr(action, 'keywords', {})
+        stmt_type = mod_map.get(keywords.get('verb'))
+        return (func.__name__, stmt_type,
+                tuple(groundings[arg] for arg in args), expand)
+
+    def respond_intent(self, key, action, args, groundings, expand,
+                       deadline):
+        """Respond to an intent, reusing its answer if it was an alternate.
+
+        Alternates are answered within the deadline of the question they
+        came from, so only complete answers are reused.
+        """
+        alternate = self.alternates.pop(key)
+        if alternate is not None and not alternate[0].cancelled():
+            try:
+                ret = alternate[0].result(timeout=deadline.remaining())
+                if ret is not None and not ret.get('partial'):
+                    logger.info('Answering %s from an earlier alternate'
+                                % str(key))
+                    return ret
+            except futures.TimeoutError:
+                cancel_alternate(alternate)
+            except Exception as e:
+                logger.exception(e)
+        return self.respond(action, args, expand=expand, deadline=deadline,
+                            groundings=groundings)
+
+    def start_alternates(self, key, matches, groundings, expand, deadline):
+        """Answer alternative matches in the background within a deadline.
+
+        The arguments of the alternatives are grounded in the background
+        too, so that answering the question with the given key doesn't
+        wait for them. The futures of the background tasks are returned
+        so that they can be cancelled before they start.
+        """
+        return [self._executor.submit(self.respond_alternate, key, action,
+                                      args, dict(groundings), expand,
+                                      deadline)
+                for action, args in matches]
+
+    def respond_alternate(self, key, action, args, groundings, expand,
+                          deadline):
+        # If the question's deadline passed while this was waiting to run,
+        # the answer is no longer needed
+        if deadline.expired():
+            return
+        groundings.update(ground_entities(args, groundings, deadline))
+        alternate_key = self.get_canonical_key(action, args, groundings,
+                                               expand)
+        # The alternate gets its own deadline so that it can be stopped if
+        # it is evicted while it is being answered
+        future = futures.Future()
+        deadline = Deadline(deadline.remaining())
+        # We reuse answers to the same intent that are already being worked
+        # on or are done
+        with self._alternates_lock:
+            if alternate_key == key or alternate_key in self.responses:
+                return
+            other = self.alternates.get(alternate_key)
+            if other is not None and not other[0].cancelled():
+                return
+            self.alternates.set(alternate_key, (future, deadline))
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            ret = self.respond(action, args, expand=expand,
+                               deadline=deadline, groundings=groundings)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(ret)
+
+    def record_cache_use(self, key, hit):
+        with self._stats_lock:
+            self.cache_stats[key[0]]['hits' if hit else 'misses'] += 1
+
+    def get_cache_hit_rates(self):
+        """Return the response cache hit rate for each type of question."""
+        with self._stats_lock:
+            return {intent_type: stats['hits'] /
+                    (stats['hits'] + stats['misses'])
+                    for intent_type, stats in self.cache_stats.items()}
+
     def ask_clarification(self, matches):
         pass
 
@@ -192,6 +424,13 @@ class IndraBot(object):
 
 
 
+def cancel_alternate(alternate):
+    """Stop answering an alternate given as a (future, deadline) tuple."""
+    future, deadline = alternate
+    future.cancel()
+    deadline.cancel()
+
+
 def get_pattern_example(pattern):
     pattern = pattern.replace('([^ ]+)', 'X')
     return pattern
@@ -218,7 +457,7 @@ affect_verbs = ['affect', 'regulate', 'control', 'target'] + \
 
 
 expander = expand_families.Expander()
-def suggest_relevant_relations(groundings):
+def suggest_relevant_relations(groundings, expanded=False, deadline=None):
     def make_nice_list(lst):
         if len(lst) == 1:
             return lst[0]
@@ -229,6 +468,8 @@ def suggest_relevant_relations(groundings):
     prefix2 = 'I also recognized'
     msg_parts = []
     for entity_txt, (dbn, dbi) in groundings.items():
+        if deadline is not None and deadline.expired():
+            break
         if dbn == 'FPLX':
             ag = Agent(name=entity_txt, db_refs={dbn: dbi})
             children = expander.get_children(ag)
@@ -238,10 +479,15 @@ def suggest_relevant_relations(groundings):
             children_names = [ch[1] for ch in children]
             children_str = make_nice_list(children_names)
             prefix = prefix1 if not msg_parts else prefix2
-            msg = ('%s "%s" as a family or complex, '
-                   'you might be interested in asking about some of its '
-                   'specific members like %s.') % (prefix, entity_txt,
-                                                   children_str)
+            if expanded:
+                msg = ('%s "%s" as a family or complex, so I also included '
+                       'results about any of its specific members %s.') % \
+                    (prefix, entity_txt, children_str)
+            else:
+                msg = ('%s "%s" as a family or complex, '
+                       'you might be interested in asking about some of its '
+                       'specific members like %s.') % (prefix, entity_txt,
+                                                       children_str)
             msg_parts.append(msg)
         if dbn == 'HGNC':
             name = hgnc_client.get_hgnc_name(dbi)
@@ -265,10 +511,46 @@ def suggest_relevant_relations(groundings):
     return full_msg
 
 
-def get_grounding_from_name(name):
+grounding_index = GroundingIndex()
+gilda_cache = TTLCache(GILDA_CACHE_SIZE, GILDA_CACHE_TTL)
+def get_grounding_from_name(name, deadline=None):
+    # Exact gene and family names are grounded without calling Gilda
+    grounding = grounding_index.ground(name)
+    if grounding:
+        logger.info('Grounded %s locally to %s:%s (local hit rate %.2f)'
+                    % (name, grounding[0], grounding[1],
+                       grounding_index.hit_rate()))
+        return grounding
+    # Names that Gilda already grounded don't need to be grounded again
+    grounding = gilda_cache.get(name)
+    if grounding:
+        return grounding
+    if deadline is None:
+        deadline = Deadline()
+    if deadline.expired():
+        logger.info('No time left to ground %s with Gilda, looking up by '
+                    'name.' % name)
+        return 'TEXT', name
+    if not gilda_breaker.allow():
+        logger.info('Gilda is unavailable, looking up %s by name.' % name)
+        return 'TEXT', name
+    if not gilda_limiter.acquire(deadline.remaining()):
+        gilda_breaker.release()
+        logger.info('Too many calls to Gilda, looking up %s by name.' % name)
+        return 'TEXT', name
     try:
         res = requests.post('http://grounding.indra.bio/ground',
-                            json={'text': name})
+                            json={'text': name},
+                            timeout=deadline.timeout(GILDA_TIMEOUT))
+    except Exception as e:
+        gilda_breaker.record_failure()
+        logger.exception(e)
+        return 'TEXT', name
+    if res.status_code >= 500:
+        gilda_breaker.record_failure()
+    else:
+        gilda_breaker.record_success()
+    try:
         if not res:
             logger.info('Could not ground %s with Gilda, looking up by name.'
                         % name)
@@ -276,121 +558,326 @@ def get_grounding_from_name(name):
         top_term = res.json()[0]['term']
         logger.info('Grounded %s with Gilda to %s:%s' % (name, top_term['db'],
                                                          top_term['id']))
-        return top_term['db'], top_term['id']
+        grounding = (top_term['db'], top_term['id'])
+        gilda_cache.set(name, grounding)
+        return grounding
     except Exception as e:
         logger.exception(e)
     return 'TEXT', name
 
 
-def get_neighborhood(entity):
-    dbn, dbi = get_grounding_from_name(entity)
+def ground_entities(entities, groundings=None, deadline=None):
+    """Return a dict of groundings keyed by entity text.
+
+    Entities that already have a grounding in the given groundings dict
+    aren't grounded again.
+    """
+    groundings = dict(groundings) if groundings else {}
+    for entity in entities:
+        if entity not in groundings:
+            groundings[entity] = get_grounding_from_name(entity, deadline)
+    return {entity: groundings[entity] for entity in entities}
+
+
+def get_neighborhood(entity, expand=False, deadline=None, groundings=None):
+    dbn, dbi = ground_entities([entity], groundings, deadline)[entity]
     key = '%s@%s' % (dbi, dbn)
-    res = get_statements(agents=[key], ev_limit=EV_LIMIT)
+    res = get_statements(agents=[key], ev_limit=EV_LIMIT, expand=expand,
+                         deadline=deadline)
     res['groundings'] = {entity: (dbn, dbi)}
     return res
 
 
-def get_activeforms(entity):
-    dbn, dbi = get_grounding_from_name(entity)
+def get_activeforms(entity, expand=False, deadline=None, groundings=None):
+    dbn, dbi = ground_entities([entity], groundings, deadline)[entity]
     key = '%s@%s' % (dbi, dbn)
     res = get_statements(agents=[key], stmt_type='ActiveForm',
-                         ev_limit=EV_LIMIT)
+                         ev_limit=EV_LIMIT, expand=expand, deadline=deadline)
     res['groundings'] = {entity: (dbn, dbi)}
     return res
 
 
-def get_phos_activeforms(entity):
-    ret = get_activeforms(entity)
+def get_phos_activeforms(entity, expand=False, deadline=None, groundings=None):
+    ret = get_activeforms(entity, expand=expand, deadline=deadline,
+                          groundings=groundings)
     ret_stmts = []
     for stmt in ret.get('stmts', []):
         for mc in stmt.agent.mods:
             if mc.mod_type == 'phosphorylation':
                 ret_stmts.append(stmt)
-    return {'stmts': ret_stmts, 'groundings': ret['groundings'],
-            'ev_counts': ret['ev_counts'],
-            'source_counts': ret['source_counts']}
+    ret['stmts'] = ret_stmts
+    return ret
 
 
-def get_binary_directed(entity1, entity2, verb=None):
-    dbn1, dbi1 = get_grounding_from_name(entity1)
+def get_binary_directed(entity1, entity2, verb=None, expand=False,
+                        deadline=None, groundings=None):
+    groundings = ground_entities([entity1, entity2], groundings, deadline)
+    dbn1, dbi1 = groundings[entity1]
     key1 = '%s@%s' % (dbi1, dbn1)
-    dbn2, dbi2 = get_grounding_from_name(entity2)
+    dbn2, dbi2 = groundings[entity2]
     key2 = '%s@%s' % (dbi2, dbn2)
     if not verb or verb not in mod_map:
-        res = get_statements(subject=key1, object=key2, ev_limit=EV_LIMIT)
+        res = get_statements(subject=key1, object=key2, ev_limit=EV_LIMIT,
+                             expand=expand, deadline=deadline)
     elif verb in mod_map:
         stmt_type = mod_map[verb]
         res = get_statements(subject=key1, object=key2,
-                             stmt_type=stmt_type, ev_limit=EV_LIMIT)
+                             stmt_type=stmt_type, ev_limit=EV_LIMIT,
+                             expand=expand, deadline=deadline)
     res['groundings'] = {entity1: (dbn1, dbi1), entity2: (dbn2, dbi2)}
     return res
 
 
-def get_binary_undirected(entity1, entity2):
-    dbn1, dbi1 = get_grounding_from_name(entity1)
+def get_binary_undirected(entity1, entity2, expand=False, deadline=None,
+                          groundings=None):
+    groundings = ground_entities([entity1, entity2], groundings, deadline)
+    dbn1, dbi1 = groundings[entity1]
     key1 = '%s@%s' % (dbi1, dbn1)
-    dbn2, dbi2 = get_grounding_from_name(entity2)
+    dbn2, dbi2 = groundings[entity2]
     key2 = '%s@%s' % (dbi2, dbn2)
-    res = get_statements(agents=[key1, key2], ev_limit=EV_LIMIT)
+    res = get_statements(agents=[key1, key2], ev_limit=EV_LIMIT,
+                         expand=expand, deadline=deadline)
     res['groundings'] = {entity1: (dbn1, dbi1), entity2: (dbn2, dbi2)}
     return res
 
 
-def get_from_source(entity, verb=None):
-    dbn, dbi = get_grounding_from_name(entity)
+def get_from_source(entity, verb=None, expand=False, deadline=None,
+                    groundings=None):
+    dbn, dbi = ground_entities([entity], groundings, deadline)[entity]
     key = '%s@%s' % (dbi, dbn)
     if not verb or verb not in mod_map:
-        res = get_statements(subject=key, ev_limit=EV_LIMIT)
+        res = get_statements(subject=key, ev_limit=EV_LIMIT, expand=expand,
+                             deadline=deadline)
     else:
         stmt_type = mod_map[verb]
         res = get_statements(subject=key, stmt_type=stmt_type,
-                             ev_limit=EV_LIMIT)
+                             ev_limit=EV_LIMIT, expand=expand,
+                             deadline=deadline)
     res['groundings'] = {entity: (dbn, dbi)}
+    return res
 
 
-def get_complex_one_side(entity):
-    dbn, dbi = get_grounding_from_name(entity)
+def get_complex_one_side(entity, expand=False, deadline=None, groundings=None):
+    dbn, dbi = ground_entities([entity], groundings, deadline)[entity]
     key = '%s@%s' % (dbi, dbn)
-    res = get_statements(agents=[key], stmt_type='Complex', ev_limit=EV_LIMIT)
+    res = get_statements(agents=[key], stmt_type='Complex', ev_limit=EV_LIMIT,
+                         expand=expand, deadline=deadline)
     res['groundings'] = {entity: (dbn, dbi)}
     return res
 
 
-def get_to_target(entity, verb=None):
-    dbn, dbi = get_grounding_from_name(entity)
+def get_to_target(entity, verb=None, expand=False, deadline=None,
+                  groundings=None):
+    dbn, dbi = ground_entities([entity], groundings, deadline)[entity]
     key = '%s@%s' % (dbi, dbn)
     if not verb or verb not in mod_map:
-        res = get_statements(object=key, ev_limit=EV_LIMIT)
+        res = get_statements(object=key, ev_limit=EV_LIMIT, expand=expand,
+                             deadline=deadline)
     else:
         stmt_type = mod_map[verb]
         res = get_statements(object=key, stmt_type=stmt_type,
-                             ev_limit=EV_LIMIT)
+                             ev_limit=EV_LIMIT, expand=expand,
+                             deadline=deadline)
     res['groundings'] = {entity: (dbn, dbi)}
     return res
 
 
-def get_statements(**kwargs):
-    # We first run the actual query and ask for a non-simple response
-    res = indra_db_rest.get_statements(simple_response=False, **kwargs)
+def get_statements(expand=False, deadline=None, **kwargs):
+    """Return a sorted list of Statements and their metadata for a query.
+
+    If expand is True, any FamPlex family or complex among the agents of
+    the query is also replaced by each of its members, and the resulting
+    queries are run in parallel and merged. If the deadline passes before
+    the query is done, the statements found so far are returned and the
+    'partial' entry of the result is set.
+    """
+    if deadline is None:
+        deadline = Deadline()
+    if expand:
+        queries = expand_query(kwargs)
+        if len(queries) > 1:
+            return get_statements_parallel(queries, deadline)
+    return _sorted_response(*_run_query(deadline, **kwargs))
+
+
+def _run_query(deadline, **kwargs):
+    if deadline.expired():
+        logger.info('No time left to query the INDRA DB.')
+        return {}, {}, {}, True
+    if not db_breaker.allow():
+        raise UpstreamUnavailable('The INDRA DB is currently unavailable.')
+    if not db_limiter.acquire(deadline.remaining()):
+        db_breaker.release()
+        logger.info('No time left to wait for the INDRA DB.')
+        return {}, {}, {}, True
+    # If the question's deadline leaves less than DB_TIMEOUT for the query,
+    # running out of time isn't necessarily the DB's fault
+    timeout = deadline.timeout(DB_TIMEOUT)
+    deadline_limited = timeout < DB_TIMEOUT
+    # We first run the actual query and ask for a non-simple response. The
+    # query runs in a thread of the processor, and with strict_stop, each of
+    # its requests is also given the same timeout.
+    try:
+        res = indra_db_rest.get_statements(simple_response=False,
+                                           strict_stop=True,
+                                           timeout=timeout,
+                                           **kwargs)
+    except Exception:
+        db_breaker.record_failure()
+        raise
+    # If the query is still running, for instance, paging through a large
+    # result, we only got part of the statements
+    partial = res.is_working()
+    # Errors in the query thread don't reach us, but the sample of
+    # statements is only set once a response came back
+    if res.statements_sample is None:
+        if deadline_limited and (partial or deadline.expired()):
+            db_breaker.release()
+            logger.info('No time left to wait for the INDRA DB.')
+            return {}, {}, {}, True
+        db_breaker.record_failure()
+        if partial:
+            logger.info('The INDRA DB did not respond within %d seconds.'
+                        % DB_TIMEOUT)
+            return {}, {}, {}, True
+        raise UpstreamUnavailable('The INDRA DB query failed.')
+    db_breaker.record_success()
+    # While the query is running, the processor's statements are still
+    # being added to so we only use the ones that came back first
+    stmts = res.statements_sample if partial else res.statements
     # We get a dict of stmts keyed by stmt hashes
-    hash_stmts_dict = res.get_hash_statements_dict()
-    # From this we can get a dict of evidence totals fore ach stmt
-    ev_totals = {int(stmt_hash): res.get_ev_count_by_hash(stmt_hash)
-                 for stmt_hash, stmt in hash_stmts_dict.items()}
-    source_counts = res.get_source_counts()
+    hash_stmts_dict = {stmt.get_hash(shallow=True): stmt for stmt in stmts}
+    # From this we can get a dict of evidence totals for each stmt
+    ev_totals = {stmt_hash: res.get_ev_count_by_hash(stmt_hash)
+                 for stmt_hash in hash_stmts_dict}
+    source_counts = {stmt_hash: res.get_source_count_by_hash(stmt_hash)
+                     for stmt_hash in hash_stmts_dict}
+    return hash_stmts_dict, ev_totals, source_counts, partial
+
+
+def _sorted_response(hash_stmts_dict, ev_totals, source_counts,
+                     partial=False):
     # We now sort the statements by most to least evidence by looking at
     # the evidence totals
     sorted_stmts = [it[1] for it in
                     sorted(hash_stmts_dict.items(),
-                           key=lambda x: ev_totals.get(int(x[0]), 0),
+                           key=lambda x: ev_totals.get(x[0], 0),
                            reverse=True)]
-    return {'stmts': sorted_stmts, 'ev_totals': ev_totals,
-            'source_counts': source_counts}
+    res = {'stmts': sorted_stmts, 'ev_totals': ev_totals,
+           'source_counts': source_counts}
+    if partial:
+        res['partial'] = True
+    return res
+
+
+def expand_query(query, max_queries=EXPAND_MAX_QUERIES):
+    """Return a list of queries with families replaced by their members.
+
+    The first query in the list is always the original one, followed by
+    all combinations in which one or more family agent keys of the query
+    are replaced by the keys of the family's members. Since all queries
+    share the INDRA DB rate limit, at most max_queries are returned,
+    preferring those in which fewer keys are replaced.
+    """
+    roles = [role for role in ('subject', 'object') if query.get(role)]
+    agent_keys = query.get('agents') or []
+    keys = [query[role] for role in roles] + list(agent_keys)
+    options = [[key] + get_member_keys(key) for key in keys]
+    # Queries replacing a single family come before the cross product of
+    # several families' members
+    combinations = sorted(itertools.product(*options),
+                          key=lambda comb: sum(new_key != key for new_key, key
+                                               in zip(comb, keys)))
+    if len(combinations) > max_queries:
+        logger.info('Expanding families gives %d queries, only running the '
+                    'first %d' % (len(combinations), max_queries))
+    queries = []
+    for combination in combinations[:max_queries]:
+        new_query = dict(query)
+        for role, key in zip(roles, combination):
+            new_query[role] = key
+        if agent_keys:
+            new_query['agents'] = list(combination[len(roles):])
+        queries.append(new_query)
+    return queries
+
+
+def get_member_keys(key):
+    """Return agent keys for the members of a family given its key."""
+    dbi, dbn = key.rsplit('@', 1)
+    if dbn != 'FPLX':
+        return []
+    ag = Agent(name=dbi, db_refs={dbn: dbi})
+    member_keys = []
+    for ns, name in expander.get_children(ag):
+        if ns == 'HGNC':
+            hgnc_id = hgnc_client.get_hgnc_id(name)
+            member_keys.append('%s@HGNC' % hgnc_id if hgnc_id
+                               else '%s@TEXT' % name)
+        else:
+            member_keys.append('%s@%s' % (name, ns))
+    return member_keys
+
+
+def get_statements_parallel(queries, deadline=None):
+    """Run a list of queries in parallel and merge their results.
+
+    Results are merged by statement hash and ranked by evidence total.
+    Queries that fail or don't finish within EXPAND_TIMEOUT seconds, or
+    before the deadline, are dropped from the merged result, which is then
+    marked as partial. If all queries fail, the last error is raised.
+    """
+    if deadline is None:
+        deadline = Deadline()
+    logger.info('Running %d queries for expanded families' % len(queries))
+    executor = futures.ThreadPoolExecutor(max_workers=EXPAND_MAX_WORKERS)
+    try:
+        query_futures = [executor.submit(_run_query, deadline, **query)
+                         for query in queries]
+        done, not_done = futures.wait(query_futures,
+                                      timeout=deadline.timeout(EXPAND_TIMEOUT))
+        for future in not_done:
+            future.cancel()
+    finally:
+        executor.shutdown(wait=False)
+    if not_done:
+        logger.info('%d of %d queries did not finish in time'
+                    % (len(not_done), len(queries)))
+    hash_stmts_dict = {}
+    ev_totals = {}
+    source_counts = {}
+    partial = bool(not_done)
+    errors = []
+    for future in query_futures:
+        if future not in done:
+            continue
+        try:
+            stmts_part, ev_totals_part, source_counts_part, partial_part = \
+                future.result()
+        except Exception as e:
+            logger.exception(e)
+            errors.append(e)
+            partial = True
+            continue
+        partial = partial or partial_part
+        # The same statement can be returned by more than one query in
+        # which case the evidence totals are the same, and we don't want to
+        # count them twice.
+        for stmt_hash, stmt in stmts_part.items():
+            hash_stmts_dict.setdefault(stmt_hash, stmt)
+            ev_totals[stmt_hash] = max(ev_totals.get(stmt_hash, 0),
+                                       ev_totals_part.get(stmt_hash, 0))
+        for stmt_hash, counts in source_counts_part.items():
+            source_counts.setdefault(stmt_hash, counts)
+    if len(errors) == len(queries):
+        raise errors[-1]
+    return _sorted_response(hash_stmts_dict, ev_totals, source_counts,
+                            partial)
 
 
 def makelambda_uni(fun, verb):
-    return lambda a: fun(a, verb)
+    return functools.partial(fun, verb=verb)
 
 
 def makelambda_bin(fun, verb):
-    return lambda a, b: fun(a, b, verb)
+    return functools.partial(fun, verb=verb)
@@ -0,0 +1,254 @@
+"""A local stand-in for Slack to test and load test the Slack bot with."""
+import json
+import time
+import base64
+import socket
+import struct
+import hashlib
+import logging
+import threading
+
+
+logger = logging.getLogger('indrabot.fake_slack')
+
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class FakeRTMServer(object):
+    """A minimal websocket server that behaves like Slack RTM.
+
+    Events passed to send_event are sent to all connected clients as text
+    frames, and RTM pings are answered with pongs.
+
+    Parameters
+    ----------
+    host : Optional[str]
+        The host to listen on. Default: 127.0.0.1
+    port : Optional[int]
+        The port to listen on. By default a free port is chosen.
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(16)
+        self.host, self.port = self.sock.getsockname()
+        self.clients = []
+        self.connections = 0
+        self.pings = 0
+        self.received = []
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._connected = threading.Condition(self._lock)
+        threading.Thread(target=self._accept_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return 'ws://%s:%d/' % (self.host, self.port)
+
+    def send_event(self, event):
+        """Send an event to all connected clients."""
+        frame = _make_frame(json.dumps(event).encode('utf-8'))
+        with self._lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                self._send(client, frame)
+            except OSError:
+                self._remove(client)
+
+    def send_message(self, text, user='U0TEST', channel='D0TEST'):
+        """Send a message event as if a user had sent it."""
+        self.send_event({'type': 'message', 'text': text, 'user': user,
+                         'channel': channel, 'ts': '%.6f' % time.time()})
+
+    def wait_for_clients(self, n=1, timeout=5):
+        """Wait until at least n clients are connected."""
+        with self._connected:
+            return self._connected.wait_for(lambda: len(self.clients) >= n,
+                                            timeout)
+
+    def drop_connections(self):
+        """Close all client connections without a closing handshake."""
+        with self._lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            client.close()
+
+    def close(self):
+        self.drop_connections()
+        self.sock.close()
+
+    def _accept_forever(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(client,),
+                             daemon=True).start()
+
+    def _serve(self, client):
+        try:
+            self._handshake(client)
+        except (OSError, ValueError) as e:
+            logger.warning('Websocket handshake failed: %s' % e)
+            client.close()
+            return
+        with self._connected:
+            self.clients.append(client)
+            self.connections += 1
+            self._connected.notify_all()
+        try:
+            while True:
+                opcode, payload = _read_frame(client)
+                if opcode == 0x8:
+                    break
+                elif opcode == 0x9:
+                    self._send(client, _make_frame(payload, opcode=0xA))
+                elif opcode == 0x1:
+                    self._handle(client, json.loads(payload.decode('utf-8')))
+        except (OSError, ValueError):
+            pass
+        self._remove(client)
+
+    def _handle(self, client, event):
+        with self._lock:
+            self.received.append(event)
+        if event.get('type') == 'ping':
+            with self._lock:
+                self.pings += 1
+            pong = {'type': 'pong', 'reply_to': event.get('id')}
+            self._send(client, _make_frame(json.dumps(pong).encode('utf-8')))
+
+    def _send(self, client, frame):
+        # Frames sent from different threads must not be interleaved
+        with self._send_lock:
+            client.sendall(frame)
+
+    def _remove(self, client):
+        with self._lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        client.close()
+
+    @staticmethod
+    def _handshake(client):
+        request = b''
+        while b'\r\n\r\n' not in request:
+            data = client.recv(4096)
+            if not data:
+                raise ValueError('Connection closed during handshake')
+            request += data
+        headers = {}
+        for line in request.decode('latin-1').split('\r\n')[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        key = headers['sec-websocket-key']
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode())
+                                  .digest()).decode()
+        client.sendall(('HTTP/1.1 101 Switching Protocols\r\n'
+                        'Upgrade: websocket\r\n'
+                        'Connection: Upgrade\r\n'
+                        'Sec-WebSocket-Accept: %s\r\n\r\n'
+                        % accept).encode())
+
+
+class FakeSlackClient(object):
+    """A stand-in for slackclient.SlackClient that captures API calls.
+
+    The Slack client always calls the Web API at slack.com, so instead of
+    serving the Web API over HTTP, calls are answered and recorded
+    in-process. The rtm.connect method returns the URL of the given
+    FakeRTMServer.
+
+    Parameters
+    ----------
+    rtm_server : FakeRTMServer
+        The RTM server that clients should connect to.
+    latency : Optional[float]
+        The number of seconds each API call takes. Default: 0
+    """
+    def __init__(self, rtm_server, latency=0):
+        self.rtm_server = rtm_server
+        self.latency = latency
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def api_call(self, method, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        # We don't keep uploaded files open
+        if 'file' in kwargs:
+            kwargs['file'].close()
+        with self._lock:
+            self.calls.append((time.time(), method, kwargs))
+        if method == 'rtm.connect':
+            return {'ok': True, 'url': self.rtm_server.url}
+        elif method in ('users.list', 'conversations.list'):
+            return {'ok': True, 'members': [], 'channels': []}
+        elif method == 'users.info':
+            return {'ok': True, 'user': {'id': kwargs['user'],
+                                         'name': kwargs['user'].lower()}}
+        elif method == 'conversations.info':
+            channel = kwargs['channel']
+            return {'ok': True, 'channel': {'id': channel,
+                                            'is_im': channel[0] == 'D'}}
+        return {'ok': True}
+
+    def get_replies(self):
+        """Return the times of messages and uploads sent to each channel."""
+        replies = {}
+        with self._lock:
+            calls = list(self.calls)
+        for ts, method, kwargs in calls:
+            if method == 'chat.postMessage':
+                replies.setdefault(kwargs['channel'], []).append(
+                    (ts, method, kwargs.get('text')))
+            elif method == 'files.upload':
+                replies.setdefault(kwargs['channels'], []).append(
+                    (ts, method, kwargs.get('filename')))
+        return replies
+
+
+def _make_frame(payload, opcode=0x1):
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 2 ** 16:
+        header += bytes([126]) + struct.pack('!H', length)
+    else:
+        header += bytes([127]) + struct.pack('!Q', length)
+    return header + payload
+
+
+def _read_frame(client):
+    b1, b2 = _recv_exactly(client, 2)
+    opcode = b1 & 0x0F
+    length = b2 & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', _recv_exactly(client, 2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', _recv_exactly(client, 8))[0]
+    mask = _recv_exactly(client, 4) if b2 & 0x80 else None
+    payload = _recv_exactly(client, length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+def _recv_exactly(client, n):
+    data = b''
+    while len(data) < n:
+        chunk = client.recv(n - len(data))
+        if not chunk:
+            raise ValueError('Connection closed')
+        data += chunk
+    return data
@@ -0,0 +1,108 @@
+"""An in-process index for grounding exact gene and family names."""
+import re
+import logging
+import threading
+from collections import defaultdict
+from indra.databases import hgnc_client
+from indra.preassembler.grounding_mapper import default_grounding_map
+
+
+logger = logging.getLogger('indrabot.grounding')
+
+
+class GroundingIndex(object):
+    """Ground exact HGNC symbols and FamPlex names without calling Gilda.
+
+    The index is built from HGNC symbols, previous HGNC symbols, FamPlex
+    entity names and the FamPlex grounding map. A name is first looked up
+    as is, and then in a case-insensitive way that also ignores dashes and
+    spaces, so that for instance "NF-kB", "nfkb" and "Nf kB" are
+    equivalent. Names that are unknown, or whose normalized form
+    corresponds to more than one grounding, are left to Gilda.
+    """
+    def __init__(self):
+        self.exact = {}
+        self.normalized = defaultdict(set)
+        self.synonyms = defaultdict(set)
+        self.deferred = set()
+        self.stats = {'local': 0, 'ambiguous': 0, 'unknown': 0}
+        self._lock = threading.Lock()
+        self._build()
+
+    def _build(self):
+        # The grounding map is curated for entity texts so it takes
+        # precedence over symbols and names.
+        for txt, db_refs in default_grounding_map.items():
+            # Texts curated to be something other than a gene or family
+            # are left to Gilda
+            grounding = _preferred_grounding(db_refs)
+            self.exact[txt] = grounding
+            if not grounding:
+                self.deferred.add(normalize(txt))
+        family_ids = {db_refs['FPLX'] for db_refs
+                      in default_grounding_map.values()
+                      if db_refs and db_refs.get('FPLX')}
+        for fplx_id in family_ids:
+            self.exact.setdefault(fplx_id, ('FPLX', fplx_id))
+        for symbol, hgnc_id in hgnc_client.hgnc_ids.items():
+            self.exact.setdefault(symbol, ('HGNC', hgnc_id))
+        for txt, grounding in self.exact.items():
+            if grounding:
+                self.normalized[normalize(txt)].add(grounding)
+        # Previous symbols are only used if nothing else matches
+        for symbol, hgnc_id in hgnc_client.prev_sym_map.items():
+            self.synonyms[normalize(symbol)].add(('HGNC', hgnc_id))
+        logger.info('Built grounding index with %d names' % len(self.exact))
+
+    def ground(self, name):
+        """Return a (db, id) tuple for a name, or None if not resolved."""
+        grounding = self._lookup(name)
+        if grounding is None:
+            result = 'unknown'
+        elif grounding == 'ambiguous':
+            result = 'ambiguous'
+            grounding = None
+        else:
+            result = 'local'
+        with self._lock:
+            self.stats[result] += 1
+        return grounding
+
+    def _lookup(self, name):
+        if name in self.exact:
+            return self.exact[name]
+        key = normalize(name)
+        if key in self.deferred:
+            return None
+        for lookup in (self.normalized, self.synonyms):
+            groundings = lookup.get(key)
+            if not groundings:
+                continue
+            if len(groundings) > 1:
+                return 'ambiguous'
+            return list(groundings)[0]
+        return None
+
+    def hit_rate(self):
+        """Return the fraction of names grounded locally."""
+        total = sum(self.stats.values())
+        return self.stats['local'] / total if total else 0.0
+
+
+def normalize(name):
+    return re.sub(r'[\s\-]', '', name).upper()
+
+
+def _preferred_grounding(db_refs):
+    if not db_refs:
+        return None
+    if db_refs.get('FPLX'):
+        return 'FPLX', db_refs['FPLX']
+    hgnc_id = db_refs.get('HGNC')
+    if hgnc_id:
+        # Depending on the version, the map can contain symbols here
+        if not hgnc_id.isdigit():
+            hgnc_id = hgnc_client.get_hgnc_id(hgnc_id)
+        if hgnc_id:
+            return 'HGNC', hgnc_id
+    return None
@@ -0,0 +1,365 @@
+"""Load test the Slack bot with many simulated concurrent users.
+
+The Slack frontend runs against a local fake Slack (see fake_slack.py), a
+stubbed INDRA DB client with configurable latency and a stubbed Gilda.
+Questions are sent at a target rate and the time until each of them is
+fully answered is measured. For instance, to send 200 questions at 5 per
+second from 20 users, with DB queries taking 0.5 +/- 0.2 seconds, run
+
+    python loadtest.py --rate 5 --count 200 --users 20 --db-latency 0.5 \
+        --db-jitter 0.2
+"""
+import os
+import time
+import random
+import logging
+import argparse
+import threading
+from indra.statements import Agent, Evidence, Activation, Inhibition, \
+    Phosphorylation, Complex
+
+import bot
+import slack
+from upstream import TTLCache
+from fake_slack import FakeRTMServer, FakeSlackClient
+
+
+logger = logging.getLogger('indrabot.loadtest')
+
+
+default_questions = [
+    'does MEK regulate ERK?',
+    'how does MEK regulate ERK?',
+    'does PTPN11 regulate RASA1?',
+    'what genes does EGR1 activate?',
+    'what forms of STAG2 are active?',
+    'what does BRAF phosphorylate?',
+    'what activates TP53?',
+    'what interacts with KRAS?',
+    'what are the targets of EGFR?',
+    'what binds GRB2?',
+]
+
+
+class StubDBRest(object):
+    """A stand-in for indra.sources.indra_db_rest with a set latency.
+
+    Parameters
+    ----------
+    latency : Optional[float]
+        The average number of seconds a query takes. Default: 0.5
+    jitter : Optional[float]
+        The largest random deviation from the average latency.
+        Default: 0
+    n_stmts : Optional[int]
+        The number of statements returned by each query. Default: 20
+    """
+    def __init__(self, latency=0.5, jitter=0, n_stmts=20):
+        self.latency = latency
+        self.jitter = jitter
+        self.n_stmts = n_stmts
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def get_statements(self, subject=None, object=None, agents=None,
+                       stmt_type=None, timeout=None, **kwargs):
+        with self._lock:
+            self.queries += 1
+        latency = max(self.latency + random.uniform(-self.jitter,
+                                                    self.jitter), 0)
+        partial = timeout is not None and latency > timeout
+        time.sleep(min(latency, timeout) if partial else latency)
+        keys = [subject, object] + (agents if agents else [])
+        names = [key.split('@')[0] for key in keys if key]
+        stmts = [_make_stmt(names, stmt_type, i)
+                 for i in range(0 if partial else self.n_stmts)]
+        return StubProcessor(stmts, partial)
+
+
+class StubProcessor(object):
+    def __init__(self, stmts, partial=False):
+        self.statements = stmts
+        # A query that timed out before its first response has no sample
+        self.statements_sample = None if partial else stmts
+        self.partial = partial
+
+    def get_ev_count_by_hash(self, stmt_hash):
+        return int(stmt_hash) % 100 + 1
+
+    def get_source_count_by_hash(self, stmt_hash):
+        return {'reach': self.get_ev_count_by_hash(stmt_hash)}
+
+    def is_working(self):
+        return self.partial
+
+
+class StubGilda(object):
+    """A stand-in for the requests module that Gilda is called with.
+
+    Names are grounded by their text, like when Gilda doesn't know them,
+    so that the load test doesn't call the Gilda web service.
+    """
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def post(self, url, json=None, timeout=None):
+        with self._lock:
+            self.calls += 1
+        return StubGildaResponse([{'term': {'db': 'TEXT',
+                                            'id': json['text']}}])
+
+
+class StubGildaResponse(object):
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+
+    def __bool__(self):
+        return True
+
+    def json(self):
+        return self.content
+
+
+def _make_stmt(names, stmt_type, i):
+    subj = Agent(names[0] if names else 'X')
+    obj = Agent(names[1] if len(names) > 1 else 'GENE%d' % i)
+    ev = Evidence(source_api='reach', pmid=str(10000 + i),
+                  text='%s affects %s in experiment %d.'
+                       % (subj.name, obj.name, i))
+    stmt_class = {'Phosphorylation': Phosphorylation,
+                  'Inhibition': Inhibition,
+                  'Complex': Complex}.get(stmt_type, Activation)
+    if stmt_class is Complex:
+        return Complex([subj, obj], evidence=[ev])
+    # Make statements distinct so that they have different hashes
+    if stmt_class is Phosphorylation:
+        return Phosphorylation(subj, obj, 'S', str(i), evidence=[ev])
+    obj.name = '%s%d' % (obj.name, i)
+    return stmt_class(subj, obj, evidence=[ev])
+
+
+def run_load_test(rate=2, count=100, users=10, questions=None,
+                  db_latency=0.5, db_jitter=0, api_latency=0.05,
+                  n_workers=None, slack_limits=True, response_cache=False,
+                  drain_timeout=120):
+    """Send questions to the Slack bot at a given rate and measure latency.
+
+    Parameters
+    ----------
+    rate : Optional[float]
+        The number of questions sent per second. Default: 2
+    count : Optional[int]
+        The total number of questions to send. Default: 100
+    users : Optional[int]
+        The number of distinct users sending questions. Default: 10
+    questions : Optional[list[str]]
+        The questions to pick from at random. Default: default_questions
+    db_latency : Optional[float]
+        The average latency of INDRA DB queries. Default: 0.5
+    db_jitter : Optional[float]
+        The largest random deviation from the DB latency. Default: 0
+    api_latency : Optional[float]
+        The latency of each Slack Web API call. Default: 0.05
+    n_workers : Optional[int]
+        The number of questions answered in parallel.
+        Default: slack.N_WORKERS
+    slack_limits : Optional[bool]
+        If False, the bot's Slack rate limits are lifted so that the rest
+        of the bot is measured. Default: True
+    response_cache : Optional[bool]
+        If True, the bot answers repeated questions from its response
+        cache, so that latencies mostly reflect cache hits. Default: False
+    drain_timeout : Optional[float]
+        The number of seconds to wait for answers after the last question
+        was sent. Default: 120
+
+    Returns
+    -------
+    dict
+        A report of latencies, throughput, dropped messages and worker
+        saturation.
+    """
+    questions = questions if questions else default_questions
+    # The bot's upstream services are stubbed and its module-level caches
+    # replaced for the duration of the test
+    patched = [(bot, 'indra_db_rest', StubDBRest(db_latency, db_jitter)),
+               (bot, 'requests', StubGilda()),
+               (slack, 'dump_to_s3',
+                lambda *args: 'https://s3.amazonaws.com/stub.html'),
+               (slack, 'channel_limiters', TTLCache(maxsize=100000, ttl=None)),
+               (bot, 'gilda_cache', TTLCache(bot.GILDA_CACHE_SIZE,
+                                             bot.GILDA_CACHE_TTL))]
+    if not slack_limits:
+        for limiter in list(slack.slack_limiters.values()) + \
+                [slack.default_slack_limiter]:
+            patched += [(limiter, 'rate', 1e6), (limiter, 'capacity', 1e6)]
+        patched.append((slack, 'channel_limits',
+                        {method: (1e6, 1e6)
+                         for method in slack.channel_limits}))
+    originals = [(obj, attr, getattr(obj, attr)) for obj, attr, _ in patched]
+    for obj, attr, value in patched:
+        setattr(obj, attr, value)
+    try:
+        return _run_load_test(rate, count, users, questions, n_workers,
+                              api_latency, response_cache, drain_timeout)
+    finally:
+        for obj, attr, value in originals:
+            setattr(obj, attr, value)
+
+
+def _run_load_test(rate, count, users, questions, n_workers, api_latency,
+                   response_cache, drain_timeout):
+    server = FakeRTMServer()
+    sc = FakeSlackClient(server, latency=api_latency)
+    logf = open(os.devnull, 'w')
+    indra_bot = bot.IndraBot(cache_responses=response_cache)
+    metadata, workers, conn = slack.start_bot(sc, indra_bot, logf, n_workers)
+    threading.Thread(target=slack.read_forever,
+                     args=(sc, metadata, workers, conn), daemon=True).start()
+    server.wait_for_clients()
+
+    # Sample how busy the workers are while the test runs
+    samples = []
+    running = threading.Event()
+    running.set()
+
+    def sample_workers():
+        while running.is_set():
+            metrics = workers.metrics()
+            samples.append((metrics['busy'] / metrics['workers'],
+                            metrics['queued']))
+            time.sleep(0.1)
+    threading.Thread(target=sample_workers, daemon=True).start()
+
+    # Each question is sent in its own direct message channel so that the
+    # replies can be told apart
+    sent = {}
+    start = time.time()
+    for i in range(count):
+        delay = start + i / rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        channel = 'DLOAD%06d' % i
+        sent[channel] = time.time()
+        server.send_message(random.choice(questions), channel=channel,
+                            user='ULOAD%04d' % (i % users))
+    logger.info('Sent %d questions in %.1f seconds'
+                % (count, time.time() - start))
+
+    # Wait until every question has a reply and the workers are idle
+    end = time.time() + drain_timeout
+    while time.time() < end:
+        metrics = workers.metrics()
+        if len(sc.get_replies()) == count and not metrics['busy'] \
+                and not metrics['queued']:
+            break
+        time.sleep(0.5)
+    time.sleep(1)
+    running.clear()
+    server.close()
+    return _make_report(sent, sc.get_replies(), samples, workers)
+
+
+def _make_report(sent, replies, samples, workers):
+    first_latencies = []
+    full_latencies = []
+    dropped = 0
+    last_reply = None
+    for channel, sent_at in sent.items():
+        channel_replies = replies.get(channel)
+        if not channel_replies or \
+                'still working on your previous' in \
+                (channel_replies[0][2] or ''):
+            dropped += 1
+            continue
+        first_latencies.append(channel_replies[0][0] - sent_at)
+        full_latencies.append(channel_replies[-1][0] - sent_at)
+        last_reply = max(last_reply or 0, channel_replies[-1][0])
+    first_sent = min(sent.values())
+    duration = (last_reply - first_sent) if last_reply else 0
+    return {
+        'sent': len(sent),
+        'answered': len(full_latencies),
+        'dropped': dropped,
+        'throughput': len(full_latencies) / duration if duration else 0,
+        'first_reply': _percentiles(first_latencies),
+        'end_to_end': _percentiles(full_latencies),
+        'worker_saturation': {
+            'mean': sum(s[0] for s in samples) / len(samples)
+            if samples else 0,
+            'max_queued': max((s[1] for s in samples), default=0),
+        },
+        'workers': workers.metrics(),
+        'db_queries': bot.indra_db_rest.queries,
+        'gilda_calls': bot.requests.calls,
+    }
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pct(p):
+        return values[min(int(p / 100 * len(values)), len(values) - 1)]
+    return {'p50': pct(50), 'p95': pct(95), 'p99': pct(99),
+            'max': values[-1]}
+
+
+def print_report(report):
+    print('Sent %d questions, %d answered, %d dropped'
+          % (report['sent'], report['answered'], report['dropped']))
+    print('Throughput: %.2f answers per second' % report['throughput'])
+    for key, title in (('first_reply', 'First reply'),
+                       ('end_to_end', 'End to end')):
+        pcts = report[key]
+        if pcts:
+            print('%s latency: p50 %.2fs, p95 %.2fs, p99 %.2fs, max %.2fs'
+                  % (title, pcts['p50'], pcts['p95'], pcts['p99'],
+                     pcts['max']))
+    saturation = report['worker_saturation']
+    print('Worker saturation: %.0f%% on average, at most %d questions '
+          'queued' % (100 * saturation['mean'], saturation['max_queued']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rate', type=float, default=2,
+                        help='Questions sent per second.')
+    parser.add_argument('--count', type=int, default=100,
+                        help='Total number of questions to send.')
+    parser.add_argument('--users', type=int, default=10,
+                        help='Number of simulated users.')
+    parser.add_argument('--questions',
+                        help='A file with one question per line to pick '
+                             'questions from.')
+    parser.add_argument('--db-latency', type=float, default=0.5,
+                        help='Average INDRA DB query latency in seconds.')
+    parser.add_argument('--db-jitter', type=float, default=0,
+                        help='Largest deviation from the DB latency.')
+    parser.add_argument('--api-latency', type=float, default=0.05,
+                        help='Latency of Slack Web API calls in seconds.')
+    parser.add_argument('--workers', type=int, default=slack.N_WORKERS,
+                        help='Number of questions answered in parallel.')
+    parser.add_argument('--no-slack-limits', action='store_true',
+                        help='Lift the rate limits on Slack API calls.')
+    parser.add_argument('--response-cache', action='store_true',
+                        help='Answer repeated questions from the cache.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    questions = None
+    if args.questions:
+        with open(args.questions, 'r') as fh:
+            questions = [line.strip() for line in fh if line.strip()]
+    report = run_load_test(rate=args.rate, count=args.count,
+                           users=args.users, questions=questions,
+                           db_latency=args.db_latency,
+                           db_jitter=args.db_jitter,
+                           api_latency=args.api_latency,
+                           n_workers=args.workers,
+                           slack_limits=not args.no_slack_limits,
+                           response_cache=args.response_cache)
+    print_report(report)
@@ -0,0 +1,90 @@
+"""Profiling of individual requests on demand."""
+import io
+import pstats
+import cProfile
+import threading
+import tracemalloc
+
+
+# The number of frames stored for each traced allocation. This has to be
+# enough to reach the profiled call from most allocations.
+TRACE_FRAMES = 64
+# tracemalloc is process-wide so we profile one request at a time
+_profile_lock = threading.Lock()
+
+
+def profile_call(func, *args, **kwargs):
+    """Call a function under cProfile and tracemalloc.
+
+    Only the calling thread is profiled. Since tracemalloc is
+    process-wide, allocations are traced in all threads while the function
+    runs, which slows them down, but only those made within the call are
+    reported. The peak memory covers all threads.
+
+    Parameters
+    ----------
+    func : callable
+        The function to call with the remaining positional and keyword
+        arguments.
+    n_top : Optional[int]
+        The number of functions and allocation sites to report.
+        Default: 15
+
+    Returns
+    -------
+    tuple
+        The return value of the function and a summary of the profile as
+        a string.
+    """
+    n_top = kwargs.pop('n_top', 15)
+    with _profile_lock:
+        tracemalloc.start(TRACE_FRAMES)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                result = _call(func, args, kwargs)
+            finally:
+                profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    # Allocations made by other threads don't go through _call in this one
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(True, __file__, _call.__code__.co_firstlineno + 1,
+                           all_frames=True)])
+    summary = summarize_profile(profiler, snapshot, peak, n_top)
+    return result, summary
+
+
+def _call(func, args, kwargs):
+    return func(*args, **kwargs)
+
+
+def summarize_profile(profiler, snapshot, peak, n_top=15):
+    """Return a compact text summary of a profile and a memory snapshot."""
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    total = max((row[3] for row in stats.stats.values()), default=0)
+    lines = ['Total time: %.3fs, peak traced memory in all threads: '
+             '%.1f KiB' % (total, peak / 1024), '',
+             'Top functions by cumulative time:',
+             '%8s %9s %9s  %s' % ('ncalls', 'tottime', 'cumtime',
+                                  'function')]
+    rows = sorted(stats.stats.items(), key=lambda x: x[1][3], reverse=True)
+    for (fname, lineno, func_name), (_, ncalls, tottime, cumtime, _) \
+            in rows[:n_top]:
+        location = '%s:%d(%s)' % (fname, lineno, func_name) if lineno \
+            else func_name
+        lines.append('%8d %8.3fs %8.3fs  %s' % (ncalls, tottime, cumtime,
+                                                 location))
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__)])
+    lines += ['', 'Top allocations by size:']
+    for stat in snapshot.statistics('lineno')[:n_top]:
+        frame = stat.traceback[0]
+        lines.append('%8.1f KiB %8d blocks  %s:%d'
+                     % (stat.size / 1024, stat.count, frame.filename,
+                        frame.lineno))
+    return '\n'.join(lines)
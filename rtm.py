@@ -0,0 +1,180 @@
+"""An event-driven connection to the Slack Real Time Messaging API."""
+import json
+import time
+import random
+import select
+import logging
+import websocket
+from collections import deque
+
+
+logger = logging.getLogger('indrabot.rtm')
+
+
+class RTMConnection(object):
+    """A websocket connection to Slack RTM that waits for incoming frames.
+
+    Instead of polling, read_events blocks on the websocket until a frame
+    arrives. If nothing is received for heartbeat_interval seconds, a ping
+    is sent, and if nothing is received for heartbeat_timeout seconds, the
+    connection is considered dead. Lost connections are reestablished with
+    jittered exponential backoff, which is only reset once a connection
+    has been up for stable_after seconds, so that a server that keeps
+    dropping connections isn't reconnected to in a tight loop.
+
+    Parameters
+    ----------
+    get_url : callable
+        A function returning the websocket URL to connect to, for
+        instance, by calling the rtm.connect Slack API method.
+    heartbeat_interval : Optional[float]
+        The number of seconds of silence after which a ping is sent.
+        Default: 30
+    heartbeat_timeout : Optional[float]
+        The number of seconds of silence after which the connection is
+        reestablished. Default: 90
+    backoff_base : Optional[float]
+        The maximal delay in seconds before the first reconnection
+        attempt, doubled with each failed attempt. Default: 1
+    backoff_max : Optional[float]
+        The largest delay in seconds between reconnection attempts.
+        Default: 60
+    stable_after : Optional[float]
+        The number of seconds a connection has to stay up before the
+        backoff is reset. Default: 60
+    """
+    def __init__(self, get_url, heartbeat_interval=30, heartbeat_timeout=90,
+                 backoff_base=1, backoff_max=60, stable_after=60):
+        self.get_url = get_url
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.ws = None
+        self.connections = 0
+        # The number of connection attempts since the last stable connection
+        self.attempts = 0
+        self.connected_at = None
+        self.last_received = None
+        self.last_ping = None
+        self.ping_id = 0
+        # The delays between Slack timestamping a message and us receiving
+        # it, i.e., the time to its first byte
+        self.latencies = deque(maxlen=1000)
+
+    def connect(self):
+        """Connect to Slack, retrying with backoff until it succeeds."""
+        while True:
+            if self.attempts:
+                max_delay = min(self.backoff_max,
+                                self.backoff_base * 2 ** (self.attempts - 1))
+                delay = random.uniform(0, max_delay)
+                logger.info('Connecting to Slack in %.1f seconds' % delay)
+                time.sleep(delay)
+            self.attempts += 1
+            try:
+                self.ws = websocket.create_connection(
+                    self.get_url(), timeout=self.heartbeat_timeout)
+                break
+            except Exception as e:
+                logger.warning('Could not connect to Slack (%s)' % e)
+        self.connections += 1
+        self.connected_at = self.last_received = self.last_ping = \
+            time.monotonic()
+        logger.info('Connected to Slack RTM')
+
+    def close(self):
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except Exception:
+                pass
+        self.ws = None
+
+    def read_events(self, timeout=None):
+        """Return the next events received, waiting for them as needed.
+
+        Parameters
+        ----------
+        timeout : Optional[float]
+            The number of seconds after which an empty list is returned if
+            no events arrive. If None, wait until there are events.
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.ws is None:
+                self.connect()
+            try:
+                wait = self._heartbeat()
+                if end is not None:
+                    wait = min(wait, max(end - time.monotonic(), 0))
+                events = self._read(wait)
+            except (websocket.WebSocketException, OSError, ValueError) as e:
+                logger.warning('Slack connection lost (%s), reconnecting'
+                               % e)
+                self.close()
+                continue
+            if self.attempts and \
+                    time.monotonic() - self.connected_at >= self.stable_after:
+                self.attempts = 0
+            if events or (end is not None and time.monotonic() >= end):
+                return events
+
+    def latency_summary(self):
+        """Return the median and maximal time to first byte of messages."""
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return {'median': latencies[len(latencies) // 2],
+                'max': latencies[-1], 'count': len(latencies)}
+
+    def _heartbeat(self):
+        # Return the number of seconds until the next heartbeat is due
+        now = time.monotonic()
+        if now - self.last_received > self.heartbeat_timeout:
+            logger.warning('No heartbeat from Slack for %.1f seconds'
+                           % (now - self.last_received))
+            self.close()
+            self.connect()
+            now = time.monotonic()
+        last_activity = max(self.last_received, self.last_ping)
+        if now - last_activity >= self.heartbeat_interval:
+            self.ping_id += 1
+            self.ws.send(json.dumps({'id': self.ping_id, 'type': 'ping'}))
+            self.last_ping = last_activity = now
+        return max(last_activity + self.heartbeat_interval - now, 0)
+
+    def _read(self, wait):
+        readable, _, _ = select.select([self.ws.sock], [], [], wait)
+        if not readable and not self._pending():
+            return []
+        events = []
+        # Several frames may be waiting to be read, some of them already
+        # decrypted in the SSL layer where select doesn't see them.
+        while True:
+            opcode, frame = self.ws.recv_data_frame(True)
+            received_at = time.time()
+            self.last_received = time.monotonic()
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                raise websocket.WebSocketConnectionClosedException(
+                    'Connection closed by Slack')
+            if opcode == websocket.ABNF.OPCODE_TEXT:
+                event = json.loads(frame.data.decode('utf-8'))
+                if event.get('type') != 'pong':
+                    self._record_latency(event, received_at)
+                    events.append(event)
+            if not self._pending():
+                return events
+
+    def _pending(self):
+        sock = self.ws.sock
+        return hasattr(sock, 'pending') and sock.pending() > 0
+
+    def _record_latency(self, event, received_at):
+        if event.get('type') != 'message' or 'ts' not in event:
+            return
+        latency = received_at - float(event['ts'])
+        self.latencies.append(latency)
+        logger.info('Message received %.3f seconds after it was sent'
+                    % latency)
@@ -1,13 +1,16 @@
+import os
 import re
 import sys
 import time
 import json
 import uuid
 import boto3
+import queue
 import pickle
 import random
 import datetime
-import websocket
+import tempfile
+import threading
 from indra.config import get_config
 from indra.assemblers.english import EnglishAssembler
 from indra.assemblers.graph import GraphAssembler
@@ -16,18 +19,67 @@ import logging
 from slackclient import SlackClient
 from indra.statements import stmts_to_json
 
-from bot import IndraBot
+from bot import IndraBot, gilda_limiter, db_limiter, grounding_index
+from rtm import RTMConnection
+from profiling import profile_call
+from upstream import TTLCache, TokenBucket, FairQueue
 
 logger = logging.getLogger('indra_slack_bot')
 
-user_cache = {}
-channel_cache = {}
+bot_id = 'U2F1KPXEW'
+
+# The number of questions answered in parallel
+N_WORKERS = 4
+# The number of questions a user can have waiting to be answered
+MAX_QUESTIONS_PER_USER = 3
+# When at least this many questions are waiting, we skip low priority
+# work like suggestions and S3 dumps
+SHED_THRESHOLD = 4
+
+# Limits on calls to Slack API methods that are limited per workspace,
+# roughly following Slack's rate limit tiers
+slack_limiters = {
+    'files.upload': TokenBucket('files.upload', rate=20 / 60, capacity=3),
+    }
+default_slack_limiter = TokenBucket('Slack', rate=20 / 60, capacity=5)
+# The rates and capacities of limits on methods that are limited per
+# channel, and the limiters of the channels we recently posted to
+channel_limits = {'chat.postMessage': (1, 3)}
+channel_limiters = TTLCache(maxsize=1000, ttl=3600)
+_channel_limiters_lock = threading.Lock()
 
 
 class IndraBotError(Exception):
     pass
 
 
+def api_call(sc, method, **kwargs):
+    """Call a Slack API method while respecting rate limits."""
+    get_slack_limiter(method, kwargs.get('channel')).acquire()
+    res = sc.api_call(method, **kwargs)
+    if res.get('error') == 'ratelimited':
+        retry_after = float(res.get('headers', {}).get('Retry-After', 1))
+        logger.warning('Slack rate limit reached for %s, retrying in %.1f '
+                       'seconds' % (method, retry_after))
+        time.sleep(retry_after)
+        res = sc.api_call(method, **kwargs)
+    return res
+
+
+def get_slack_limiter(method, channel=None):
+    """Return the rate limiter for calling a method in a given channel."""
+    if method not in channel_limits or not channel:
+        return slack_limiters.get(method, default_slack_limiter)
+    with _channel_limiters_lock:
+        limiter = channel_limiters.get((method, channel))
+        if limiter is None:
+            rate, capacity = channel_limits[method]
+            limiter = TokenBucket('%s %s' % (method, channel), rate=rate,
+                                  capacity=capacity)
+            channel_limiters.set((method, channel), limiter)
+        return limiter
+
+
 def read_slack_token(fname=None):
     # Token can be found at https://api.slack.com/web#authentication
     if fname is None:
@@ -41,55 +93,126 @@ def read_slack_token(fname=None):
         return None
 
 
-def get_user_name(sc, user_id):
-    user_name = user_cache.get(user_id)
-    if user_name:
+class SlackMetadata(object):
+    """Caches of Slack user names and channel info.
+
+    Users and conversations are fetched in bulk by prefetch() and then
+    periodically refreshed in the background. Lookups never call the Slack
+    API themselves: on a cache miss, the entry is fetched in the background
+    and a best guess is returned in the meantime.
+
+    Parameters
+    ----------
+    sc : slackclient.SlackClient
+        The Slack client used for calling the API.
+    maxsize : Optional[int]
+        The maximum number of users and channels to cache. Default: 10000
+    ttl : Optional[float]
+        The number of seconds after which cached entries expire.
+        Default: 86400
+    refresh_interval : Optional[float]
+        The number of seconds between background refreshes. Default: 3600
+    """
+    def __init__(self, sc, maxsize=10000, ttl=86400, refresh_interval=3600):
+        self.sc = sc
+        self.users = TTLCache(maxsize, ttl)
+        self.channels = TTLCache(maxsize, ttl)
+        self.refresh_interval = refresh_interval
+        self._lookups = queue.Queue()
+        self._pending = set()
+
+    def start(self):
+        """Prefetch all metadata and start the background threads."""
+        self.prefetch()
+        for target in (self._refresh_forever, self._lookup_forever):
+            threading.Thread(target=target, daemon=True).start()
+
+    def prefetch(self):
+        for user in self._paginate('users.list', 'members'):
+            self.users.set(user['id'], user['name'])
+        for channel in self._paginate(
+                'conversations.list', 'channels',
+                types='public_channel,private_channel,mpim,im'):
+            self.channels.set(channel['id'], _channel_info(channel))
+        logger.info('Prefetched %d users and %d channels'
+                    % (len(self.users), len(self.channels)))
+
+    def get_user_name(self, user_id):
+        user_name = self.users.get(user_id)
+        if user_name is None:
+            self._lookup_later('user', user_id)
+            return user_id
         return user_name
-    res = sc.server.api_call('users.info', users=user_id)
-    user_info = json.loads(res)
-    for user in user_info['users']:
-        if user['id'] == user_id:
-            user_cache[user_id] = user['name']
-            return user['name']
-    return None
-
 
-def get_channel_info(sc, channel_id):
-    # Return from cache if possible
-    if channel_id in channel_cache:
-        return channel_cache[channel_id]
-
-    # First, we try channels.info which only works for public channels
-    res = sc.server.api_call('channels.info', channel=channel_id)
-    res_json = json.loads(res)
-    # If we got a channel, then this is a public channel and we can
-    # cache its info
-    if 'channel' in res_json:
-        channel_info = res_json['channel']
-    # If this is not a public channel, we get groups.info instead which can
-    # reveal if this is a private channel
-    else:
-        res = sc.server.api_call('groups.info', channel=channel_id)
-        res_json = json.loads(res)
-        if 'channel' in res_json:
-            channel_info = res_json['channel']
-        elif res_json.get('error') == 'channel_not_found':
-            channel_info = 'PRIVATE'
+    def get_channel_info(self, channel_id):
+        channel_info = self.channels.get(channel_id)
+        if channel_info is None:
+            self._lookup_later('channel', channel_id)
+            # IDs of direct message channels start with a D
+            return 'PRIVATE' if channel_id.startswith('D') else 'UNKNOWN'
+        return channel_info
+
+    def _paginate(self, method, key, **kwargs):
+        kwargs['limit'] = 200
+        while True:
+            res = api_call(self.sc, method, **kwargs)
+            if not res.get('ok'):
+                logger.error('Could not call %s: %s' % (method,
+                                                        res.get('error')))
+                return
+            for item in res.get(key, []):
+                yield item
+            cursor = res.get('response_metadata', {}).get('next_cursor')
+            if not cursor:
+                return
+            kwargs['cursor'] = cursor
+
+    def _lookup_later(self, kind, item_id):
+        if (kind, item_id) in self._pending:
+            return
+        self._pending.add((kind, item_id))
+        self._lookups.put((kind, item_id))
+
+    def _lookup(self, kind, item_id):
+        if kind == 'user':
+            res = api_call(self.sc, 'users.info', user=item_id)
+            if res.get('ok'):
+                self.users.set(item_id, res['user']['name'])
         else:
-            print(res_json)
-            print('Unexpected channel info.')
-            channel_info = 'UNKNOWN'
-    channel_cache[channel_id] = channel_info
-    return channel_info
+            res = api_call(self.sc, 'conversations.info', channel=item_id)
+            if res.get('ok'):
+                self.channels.set(item_id, _channel_info(res['channel']))
+            elif res.get('error') == 'channel_not_found':
+                self.channels.set(item_id, 'UNKNOWN')
+            else:
+                logger.warning('Unexpected channel info for %s: %s'
+                               % (item_id, res))
 
+    def _lookup_forever(self):
+        while True:
+            kind, item_id = self._lookups.get()
+            try:
+                self._lookup(kind, item_id)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                self._pending.discard((kind, item_id))
 
-def read_message(sc):
-    events = sc.rtm_read()
-    if not events:
-        print('.', end='', flush=True)
-        return None
-    logger.info('%s events happened' % len(events))
-    event = events[0]
+    def _refresh_forever(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.prefetch()
+            except Exception as e:
+                logger.exception(e)
+
+
+def _channel_info(channel):
+    # We only answer in direct messages which are marked as PRIVATE
+    return 'PRIVATE' if channel.get('is_im') else channel
+
+
+def read_message(event, metadata):
     event_type = event.get('type')
     if not event_type:
         return
@@ -107,7 +230,7 @@ def read_message(sc):
             #logger.info(msg)
             return -1
         channel = event['channel']
-        user_name = get_user_name(sc, user)
+        user_name = metadata.get_user_name(user)
         #channel_name = get_channel_name(sc, channel)
         logger.info('Message received - [%s]: %s' %
                     (user_name, msg))
@@ -116,9 +239,9 @@ def read_message(sc):
 
 
 def send_message(sc, channel, msg):
-    sc.api_call("chat.postMessage",
-                channel=channel,
-                text=msg, as_user=True)
+    api_call(sc, "chat.postMessage",
+             channel=channel,
+             text=msg, as_user=True)
     logger.info('Message sent: %s' % msg)
 
 
@@ -144,12 +267,12 @@ def format_stmts(stmts, output_format, ev_counts=None, source_counts=None):
             msg += line
         return msg
     elif output_format == 'pkl':
-        fname = 'indrabot.pkl'
+        fname = _make_fname('pkl')
         with open(fname, 'wb') as fh:
             pickle.dump(stmts, fh)
         return fname
     elif output_format == 'pdf':
-        fname = 'indrabot.pdf'
+        fname = _make_fname('pdf')
         ga = GraphAssembler(stmts)
         ga.make_model()
         ga.save_pdf(fname)
@@ -161,16 +284,22 @@ def format_stmts(stmts, output_format, ev_counts=None, source_counts=None):
         ev_counts = {} if not ev_counts else ev_counts
         ha = HtmlAssembler(stmts, ev_totals=ev_counts,
                            source_counts=source_counts)
-        fname = 'indrabot.html'
+        fname = _make_fname('html')
         ha.save_model(fname)
         return fname
     return None
 
 
+def _make_fname(ext):
+    # Questions are answered in parallel so each answer needs its own file
+    return os.path.join(tempfile.gettempdir(),
+                        'indrabot_%s.%s' % (uuid.uuid4(), ext))
+
+
 db_rest_url = get_config('INDRA_DB_REST_URL')
 
 
-def dump_to_s3(stmts, ev_counts, source_counts):
+def dump_to_s3(stmts, ev_totals, source_counts):
     s3 = boto3.client('s3')
     bucket = 'indrabot-results'
     fname = '%s.html' % uuid.uuid4()
@@ -255,6 +384,13 @@ def help_message(long=False, topic=None):
                  "*pickle:"
                  "A Python pickle file containing a pickle of the list of "
                  "INDRA Statement objects."
+                 "\n"
+                 "Profiling:\n"
+                 "If you end your message with `/profile`, I will also "
+                 "send you a summary of where the time and memory went "
+                 "while answering your question. Only one question is "
+                 "profiled at a time, and while it is, other questions "
+                 "are answered a bit slower."
                  "")
     return short_help + long_help if long else short_help + get_more
 
@@ -264,139 +400,304 @@ def _connect():
     if not token:
         raise IndraBotError("Could not get slack token.")
     sc = SlackClient(token)
-    conn = sc.rtm_connect()
-    if not conn:
-        raise IndraBotError('Could not connect to Slack.')
     return sc
 
 
-if __name__ == '__main__':
-    logf = open('slack_bot_log.txt', 'a', 1)
-    bot = IndraBot()
-    bot_id = 'U2F1KPXEW'
+def _rtm_url(sc):
+    res = sc.api_call('rtm.connect')
+    if not res.get('ok'):
+        raise IndraBotError('Could not connect to Slack: %s'
+                            % res.get('error'))
+    return res['url']
 
-    sc = _connect()
-    while True:
-        try:
-            try:
-                res = read_message(sc)
-            except:
-                # Try one more time with a fresh connection.
-                sc = _connect()
-                res = read_message(sc)
-            if res == -1:
-                continue
-            elif res:
-                (channel, username, msg, userid) = res
-                # Skip own messages
-                if userid == bot_id:
-                    continue
+
+def handle_message(sc, bot, metadata, logf, channel, msg, userid,
+                   shed=False):
+    """Answer a message received from a user in a given channel.
+
+    If shed is True, low priority work like making suggestions and dumping
+    results to S3 is skipped.
+    """
+    log_prefix = ''
+    try:
+        channel_info = metadata.get_channel_info(channel)
+        # If this is not a private convo and the bot wasn't named,
+        # then we don't answer.
+        if channel_info != 'PRIVATE':
+            return
+        # We also skip file uploads
+        if 'uploaded a file' in msg:
+            return
+        # Replace our own ID in the message if it's in there
+        msg = msg.replace('<@%s>' % bot_id, '').strip()
+
+        ts = '{:%Y-%m-%d %H:%M:%S}'.format(datetime.datetime.now())
+
+        log_prefix = '%s\t%s\t%s\t' % (msg, userid, ts)
+
+        # Try to get magic modifiers, several of which can be combined as
+        # in "what does BRAF phosphorylate /json /profile"
+        output_format = None
+        profile = False
+        mods = ['pkl', 'pdf', 'tsv', 'json', 'html', 'profile']
+        while True:
+            mod = next((mod for mod in mods if msg.endswith('/%s' % mod)),
+                       None)
+            if mod is None:
+                break
+            msg = msg[:-(len(mod)+1)].strip()
+            if mod == 'profile':
+                profile = True
+            elif output_format is None:
+                output_format = mod
+        if output_format is None:
+            output_format = 'tsv'
+
+        if re.sub('[.,?!;:]', '', msg.lower()) in \
+                ['help', 'what can you do']:
+            msg = re.sub('[.,?!;:]', '', msg.lower())
+            help_resp = help_message(
+                long=msg == 'what can you do')
+            send_message(sc, channel, help_resp)
+            return
+
+        # Under load we skip suggestions and answering alternative
+        # interpretations of the question
+        question_kwargs = {'suggest': False, 'speculate': False} if shed \
+            else {}
+        if profile:
+            # Answers from the cache wouldn't show why a question is slow
+            resp, summary = profile_call(bot.handle_question, msg,
+                                         use_cache=False, **question_kwargs)
+            api_call(sc, "files.upload",
+                     channels=channel,
+                     filename='indrabot_profile.txt',
+                     filetype='text',
+                     content=summary,
+                     title='Profile of "%s"' % msg)
+        else:
+            resp = bot.handle_question(msg, **question_kwargs)
+        if 'question' in resp:
+            msg = resp['question']
+            send_message(sc, channel, msg)
+            logf.write(log_prefix + 'C\n')
+            return
+
+        resp_stmts = resp['stmts']
+        ev_totals = resp.get('ev_totals', {})
+        source_counts = resp.get('source_counts', {})
+
+        logf.write(log_prefix + '%d\n' % len(resp_stmts))
+
+        prefixes = ['That\'s a great question',
+                    'What an interesting question',
+                    'As always, I\'m happy to answer that',
+                    'Very interesting']
+        preamble = ('Please note that the indrabot is being phased '
+                    'out and replaced by a next generation dialogue '
+                    'agent called `clare`. Please send a message'
+                    ' to the `clare` bot with your question. ')
+        prefixes = [preamble + p for p in prefixes]
+        prefix = random.choice(prefixes)
+        msg = "%s, <@%s>" % (prefix, userid)
+        if len(resp_stmts) == 0:
+            msg += ' but I couldn\'t find any statements about ' \
+                   'that.'
+        else:
+            msg += '! I found %d statement%s about that.' % \
+                     (len(resp_stmts),
+                      ('s' if (len(resp_stmts) > 1) else ''))
+        if resp.get('partial'):
+            msg += ' I ran out of time while looking, so there ' \
+                   'might be more.'
+        send_message(sc, channel, msg)
+        if resp_stmts:
+            reply = format_stmts(resp_stmts, output_format,
+                                 ev_totals, source_counts)
+            if output_format in ('tsv', 'json'):
+                api_call(sc, "files.upload",
+                         channels=channel,
+                         filename='indrabot.%s' % output_format,
+                         filetype=output_format,
+                         content=reply,
+                         text=msg)
+            else:
                 try:
-                    channel_info = get_channel_info(sc, channel)
-                    # If this is not a private convo and the bot wasn't named,
-                    # then we don't answer.
-                    if channel_info != 'PRIVATE':
-                        continue
-                    # We also skip file uploads
-                    if 'uploaded a file' in msg:
-                        continue
-                    # Replace our own ID in the message if it's in there
-                    msg = msg.replace('<@%s>' % bot_id, '').strip()
-
-                    ts = '{:%Y-%m-%d %H:%M:%S}'.format(datetime.datetime.now())
-
-                    logf.write('%s\t%s\t%s\t' % (msg, userid, ts))
-
-                    # Try to get magic modifiers
-                    output_format = 'tsv'
-                    mods = ['pkl', 'pdf', 'tsv', 'json', 'html']
-                    for mod in mods:
-                        if msg.endswith('/%s' % mod):
-                            output_format = mod
-                            msg = msg[:-(len(mod)+1)].strip()
-                            break
-
-                    if re.sub('[.,?!;:]', '', msg.lower()) in \
-                            ['help', 'what can you do']:
-                        msg = re.sub('[.,?!;:]', '', msg.lower())
-                        help_resp = help_message(
-                            long=msg == 'what can you do')
-                        send_message(sc, channel, help_resp)
-                        continue
-
-                    resp = bot.handle_question(msg)
-                    if 'question' in resp:
-                        msg = resp['question']
-                        send_message(sc, channel, msg)
-                        logf.write('C\n')
-                        continue
-
-                    resp_stmts = resp['stmts']
-                    ev_totals = resp.get('ev_totals', {})
-                    source_counts = resp.get('source_counts', {})
-
-                    logf.write('%d\n' % len(resp_stmts))
-
-                    prefixes = ['That\'s a great question',
-                                'What an interesting question',
-                                'As always, I\'m happy to answer that',
-                                'Very interesting']
-                    preamble = ('Please note that the indrabot is being phased '
-                                'out and replaced by a next generation dialogue '
-                                'agent called `clare`. Please send a message'
-                                ' to the `clare` bot with your question. ')
-                    prefixes = [preamble + p for p in prefixes]
-                    prefix = random.choice(prefixes)
-                    msg = "%s, <@%s>" % (prefix, userid)
-                    if len(resp_stmts) == 0:
-                        msg += ' but I couldn\'t find any statements about ' \
-                               'that.'
-                    else:
-                        msg += '! I found %d statement%s about that.' % \
-                                 (len(resp_stmts),
-                                  ('s' if (len(resp_stmts) > 1) else ''))
+                    with open(reply, 'rb') as fh:
+                        api_call(sc, "files.upload",
+                                 channels=channel,
+                                 filename='indrabot.%s' % output_format,
+                                 filetype=output_format,
+                                 file=fh,
+                                 text=msg)
+                finally:
+                    os.remove(reply)
+            # Try dumping to S3 unless we're busy
+            if shed:
+                logger.info('Skipping S3 dump under load.')
+            else:
+                try:
+                    url = dump_to_s3(resp_stmts, ev_totals,
+                                     source_counts)
+                    msg = ('You can also view these results here: %s'
+                           % url)
                     send_message(sc, channel, msg)
-                    if resp_stmts:
-                        reply = format_stmts(resp_stmts, output_format,
-                                             ev_totals, source_counts)
-                        if output_format in ('tsv', 'json'):
-                            sc.api_call("files.upload",
-                                        channels=channel,
-                                        filename='indrabot.%s' % output_format,
-                                        filetype=output_format,
-                                        content=reply,
-                                        text=msg)
-                        else:
-                            sc.api_call("files.upload",
-                                        channels=channel,
-                                        filename='indrabot.%s' % output_format,
-                                        filetype=output_format,
-                                        file=open(reply, 'rb'),
-                                        text=msg)
-                        # Try dumping to S3
-                        try:
-                            url = dump_to_s3(resp_stmts, ev_totals,
-                                             source_counts)
-                            msg = ('You can also view these results here: %s'
-                                   % url)
-                            send_message(sc, channel, msg)
-                        except Exception as e:
-                            logger.exception(e)
-                    if 'suggestion' in resp:
-                        print(resp['suggestion'])
-                        send_message(sc, channel, resp['suggestion'])
-
-                except websocket.WebSocketException as e:
-                    logger.warning('connection closed')
-                    continue
                 except Exception as e:
                     logger.exception(e)
-                    logf.write('%d\n' % -1)
-                    reply = 'Sorry, I can\'t answer that, ask something else.'
-                    send_message(sc, channel, reply)
-            else:
-                time.sleep(2)
-        except KeyboardInterrupt:
-            logf.close()
-            logger.info('Shutting down due to keyboard interrupt.')
-            sys.exit()
+        if 'suggestion' in resp:
+            print(resp['suggestion'])
+            send_message(sc, channel, resp['suggestion'])
+
+    except Exception as e:
+        logger.exception(e)
+        logf.write(log_prefix + '%d\n' % -1)
+        reply = 'Sorry, I can\'t answer that, ask something else.'
+        send_message(sc, channel, reply)
+
+
+class QuestionWorkers(object):
+    """Threads answering questions taken from a per-user fairness queue.
+
+    Parameters
+    ----------
+    answer : callable
+        A function called with the user ID, the question item and whether
+        low priority work should be shed.
+    n_workers : Optional[int]
+        The number of questions answered in parallel. Default: N_WORKERS
+    """
+    def __init__(self, answer, n_workers=None):
+        self.answer = answer
+        self.n_workers = n_workers if n_workers else N_WORKERS
+        self.questions = FairQueue(MAX_QUESTIONS_PER_USER)
+        self.busy = 0
+        self.answered = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        for _ in range(self.n_workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def submit(self, userid, item):
+        """Queue a question, return False if the user has too many queued.
+        """
+        return self.questions.put(userid, item)
+
+    def metrics(self):
+        metrics = self.questions.metrics()
+        metrics.update({'busy': self.busy, 'workers': self.n_workers,
+                        'answered': self.answered})
+        return metrics
+
+    def _work(self):
+        while True:
+            userid, item = self.questions.get()
+            shed = len(self.questions) >= SHED_THRESHOLD
+            with self._lock:
+                self.busy += 1
+            try:
+                self.answer(userid, item, shed)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                with self._lock:
+                    self.busy -= 1
+                    self.answered += 1
+
+
+def get_metrics(workers, bot, conn=None):
+    """Return the state of the question queue, rate limiters and caches,
+    and the time to first byte of messages received over RTM."""
+    limiters = [gilda_limiter, db_limiter, default_slack_limiter] + \
+        list(slack_limiters.values())
+    metrics = {'questions': workers.metrics(),
+               'limiters': {limiter.name: limiter.metrics()
+                            for limiter in limiters},
+               'response_cache_hit_rates': bot.get_cache_hit_rates(),
+               'local_grounding_hit_rate': grounding_index.hit_rate()}
+    if conn is not None:
+        metrics['rtm_time_to_first_byte'] = conn.latency_summary()
+        metrics['rtm_connections'] = conn.connections
+    return metrics
+
+
+def log_metrics_forever(workers, bot, conn=None, interval=300):
+    while True:
+        time.sleep(interval)
+        logger.info('Metrics: %s'
+                    % json.dumps(get_metrics(workers, bot, conn)))
+
+
+def start_bot(sc, bot, logf, n_workers=None):
+    """Start the background parts of the bot and connect to Slack RTM.
+
+    Parameters
+    ----------
+    sc : slackclient.SlackClient
+        The Slack client used for calling the API.
+    bot : bot.IndraBot
+        The bot answering the questions.
+    logf : file
+        The file to log questions and the number of statements found to.
+    n_workers : Optional[int]
+        The number of questions answered in parallel. Default: N_WORKERS
+
+    Returns
+    -------
+    tuple
+        The SlackMetadata, QuestionWorkers and RTMConnection to pass to
+        read_forever.
+    """
+    metadata = SlackMetadata(sc)
+    metadata.start()
+    workers = QuestionWorkers(
+        lambda userid, item, shed: handle_message(sc, bot, metadata, logf,
+                                                  item[0], item[1], userid,
+                                                  shed),
+        n_workers)
+    workers.start()
+    conn = RTMConnection(lambda: _rtm_url(sc))
+    threading.Thread(target=log_metrics_forever, args=(workers, bot, conn),
+                     daemon=True).start()
+    conn.connect()
+    return metadata, workers, conn
+
+
+def read_forever(sc, metadata, workers, conn):
+    """Read messages from Slack and queue them to be answered."""
+    while True:
+        for event in conn.read_events():
+            # An error handling one event mustn't stop the bot
+            try:
+                read_event(sc, metadata, workers, event)
+            except Exception as e:
+                logger.exception(e)
+
+
+def read_event(sc, metadata, workers, event):
+    res = read_message(event, metadata)
+    if not res or res == -1:
+        return
+    (channel, username, msg, userid) = res
+    # Skip own messages
+    if userid == bot_id:
+        return
+    if not workers.submit(userid, (channel, msg)) and \
+            metadata.get_channel_info(channel) == 'PRIVATE':
+        send_message(sc, channel,
+                     'I\'m still working on your previous '
+                     'questions, please ask me again in a bit.')
+
+
+if __name__ == '__main__':
+    logf = open('slack_bot_log.txt', 'a', 1)
+    bot = IndraBot()
+
+    sc = _connect()
+    metadata, workers, conn = start_bot(sc, bot, logf)
+    try:
+        read_forever(sc, metadata, workers, conn)
+    except KeyboardInterrupt:
+        logf.close()
+        logger.info('Shutting down due to keyboard interrupt.')
+        sys.exit()
@@ -1,3 +1,4 @@
+import time
 from bot import IndraBot
 bot = IndraBot()
 
@@ -13,3 +14,28 @@ ret = bot.handle_question('what genes does EGR1 activate?')
 assert ret['stmts']
 ret = bot.handle_question('what forms of STAG2 are active?')
 assert ret['stmts']
+
+bot = IndraBot(expand_members=True)
+ret = bot.handle_question('does MEK regulate ERK?')
+assert ret['stmts']
+ret = bot.handle_question('what does RAF phosphorylate?')
+assert ret['stmts']
+
+bot = IndraBot(speculate=True)
+ret = bot.handle_question('does phosphorylation activate MAPK1?')
+assert ret['stmts']
+# The other interpretation of the question is answered in the background
+# once its arguments are grounded
+end = time.time() + 10
+while len(bot.alternates) < 1 and time.time() < end:
+    time.sleep(0.1)
+assert len(bot.alternates) == 1
+ret = bot.handle_question('can phosphorylation activate MAPK1?')
+assert len(bot.alternates) == 0
+
+# Paraphrases of the same question are answered from the cache
+bot = IndraBot()
+ret1 = bot.handle_question('does MEK regulate ERK?')
+ret2 = bot.handle_question('Can mek regulate ERK')
+assert ret1['stmts'] == ret2['stmts']
+assert bot.cache_stats['get_binary_directed'] == {'hits': 1, 'misses': 1}
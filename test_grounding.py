@@ -0,0 +1,41 @@
+from grounding import GroundingIndex, normalize
+
+gi = GroundingIndex()
+
+# Answers recorded from Gilda for exact gene and family names
+gilda_answers = {
+    'MEK': ('FPLX', 'MEK'),
+    'ERK': ('FPLX', 'ERK'),
+    'RAF': ('FPLX', 'RAF'),
+    'NF-kB': ('FPLX', 'NFkappaB'),
+    'TP53': ('HGNC', '11998'),
+    'EGR1': ('HGNC', '3238'),
+    'BRAF': ('HGNC', '1097'),
+    'KRAS': ('HGNC', '6407'),
+    'MAPK1': ('HGNC', '6871'),
+    'MAP2K1': ('HGNC', '6840'),
+    'PTPN11': ('HGNC', '9644'),
+    'RASA1': ('HGNC', '9871'),
+    'STAG2': ('HGNC', '11355'),
+}
+
+
+def test_consistent_with_gilda():
+    for name, grounding in gilda_answers.items():
+        assert gi.ground(name) == grounding, name
+
+
+def test_case_variants():
+    assert gi.ground('braf') == ('HGNC', '1097')
+    assert gi.ground('Erk') == ('FPLX', 'ERK')
+    assert gi.ground('nfkb') == ('FPLX', 'NFkappaB')
+
+
+def test_unknown():
+    assert gi.ground('xyzzy-not-a-gene') is None
+    assert gi.stats['unknown'] > 0
+    assert 0 < gi.hit_rate() < 1
+
+
+def test_normalize():
+    assert normalize('NF-kB') == normalize('nf kb') == 'NFKB'
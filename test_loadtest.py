@@ -0,0 +1,10 @@
+from loadtest import run_load_test
+
+
+def test_run_load_test():
+    report = run_load_test(rate=20, count=5, db_latency=0, api_latency=0,
+                           slack_limits=False, drain_timeout=30)
+    assert report['sent'] == 5
+    assert report['answered'] == 5
+    assert report['dropped'] == 0
+    assert set(report['end_to_end']) == {'p50', 'p95', 'p99', 'max'}
@@ -0,0 +1,58 @@
+import time
+import threading
+import tracemalloc
+from profiling import profile_call
+
+
+def make_squares(n):
+    return [i * i for i in range(n)]
+
+
+def test_profile_call():
+    result, summary = profile_call(make_squares, 1000, n_top=5)
+    assert result == make_squares(1000)
+    assert 'make_squares' in summary
+    assert 'Top allocations by size' in summary
+    assert not tracemalloc.is_tracing()
+
+
+def test_profile_call_other_threads():
+    # Allocations made by other threads while profiling are not reported
+    started = threading.Event()
+    done = threading.Event()
+    other = []
+
+    def allocate():
+        started.set()
+        while not done.is_set():
+            other.append(bytearray(10000))
+            time.sleep(0.001)
+
+    def wait_and_square():
+        time.sleep(0.05)
+        return make_squares(1000)
+
+    thread = threading.Thread(target=allocate)
+    thread.start()
+    started.wait()
+    try:
+        _, summary = profile_call(wait_and_square)
+    finally:
+        done.set()
+        thread.join()
+    assert 'wait_and_square' in summary
+    assert 'test_profiling.py:%d' % (make_squares.__code__.co_firstlineno
+                                     + 1) in summary
+    assert 'test_profiling.py:%d' % (allocate.__code__.co_firstlineno
+                                     + 3) not in summary
+
+
+def test_profile_call_error():
+    def fail():
+        raise ValueError('failed')
+    try:
+        profile_call(fail)
+        assert False
+    except ValueError:
+        pass
+    assert not tracemalloc.is_tracing()
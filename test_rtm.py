@@ -0,0 +1,77 @@
+import time
+from rtm import RTMConnection
+from fake_slack import FakeRTMServer
+
+
+def test_read_events():
+    server = FakeRTMServer()
+    conn = RTMConnection(lambda: server.url)
+    conn.connect()
+    assert server.wait_for_clients()
+    server.send_message('does MEK regulate ERK?')
+    events = conn.read_events(timeout=5)
+    assert len(events) == 1
+    assert events[0]['text'] == 'does MEK regulate ERK?'
+    assert conn.latency_summary()['count'] == 1
+    assert conn.read_events(timeout=0.1) == []
+    server.close()
+
+
+def test_heartbeat():
+    server = FakeRTMServer()
+    conn = RTMConnection(lambda: server.url, heartbeat_interval=0.1)
+    conn.read_events(timeout=0.5)
+    assert server.pings >= 2
+    # Pongs aren't passed on as events
+    assert conn.read_events(timeout=0.2) == []
+    server.close()
+
+
+def test_reconnect():
+    server = FakeRTMServer()
+    conn = RTMConnection(lambda: server.url, backoff_base=0.01)
+    conn.connect()
+    assert server.wait_for_clients()
+    server.drop_connections()
+    conn.read_events(timeout=0.5)
+    assert server.wait_for_clients()
+    assert conn.connections == 2
+    server.send_message('what does BRAF phosphorylate?')
+    events = conn.read_events(timeout=5)
+    assert events[0]['text'] == 'what does BRAF phosphorylate?'
+    server.close()
+
+
+def test_connect_backoff():
+    server = FakeRTMServer()
+    attempts = []
+
+    def get_url():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise ConnectionError('Slack is down')
+        return server.url
+
+    conn = RTMConnection(get_url, backoff_base=0.01)
+    conn.connect()
+    assert len(attempts) == 3
+    assert conn.connections == 1
+    server.close()
+
+
+def test_backoff_kept_across_drops():
+    server = FakeRTMServer()
+    conn = RTMConnection(lambda: server.url, backoff_base=0.01,
+                         stable_after=0.3)
+    conn.connect()
+    assert server.wait_for_clients()
+    # A connection that is dropped right away doesn't reset the backoff
+    server.drop_connections()
+    conn.read_events(timeout=0.1)
+    assert conn.connections == 2
+    assert conn.attempts == 2
+    # Once the connection has been up for a while, it does
+    time.sleep(0.3)
+    conn.read_events(timeout=0.1)
+    assert conn.attempts == 0
+    server.close()
@@ -0,0 +1,115 @@
+import time
+from upstream import Deadline, CircuitBreaker, TTLCache, TokenBucket, \
+    FairQueue
+
+
+def test_deadline():
+    deadline = Deadline()
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    assert deadline.timeout(5) == 5
+    deadline = Deadline(10)
+    assert 9 < deadline.remaining() <= 10
+    assert deadline.timeout(5) == 5
+    assert deadline.timeout() <= 10
+    deadline = Deadline(0)
+    assert deadline.expired()
+    assert deadline.timeout(5) == 0
+    deadline = Deadline()
+    deadline.cancel()
+    assert deadline.expired()
+    assert deadline.timeout(5) == 0
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.05)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    time.sleep(0.06)
+    # Only a single trial call is let through when half-open
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+
+
+def test_ttl_cache():
+    cache = TTLCache(maxsize=2, ttl=0.05)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    # b is now the least recently used entry so it's evicted
+    cache.set('c', 3)
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert len(cache) == 2
+    assert cache.hits == 1 and cache.misses == 1
+    time.sleep(0.06)
+    assert cache.get('a') is None
+    assert 'c' not in cache
+
+
+def test_ttl_cache_on_evict():
+    evicted = []
+    cache = TTLCache(maxsize=2, ttl=0.05,
+                     on_evict=lambda key, value: evicted.append(key))
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.set('a', 3)
+    cache.set('c', 4)
+    assert cache.pop('a') == 3
+    assert evicted == ['a', 'b']
+    time.sleep(0.06)
+    assert cache.get('c') is None
+    assert evicted == ['a', 'b', 'c']
+
+
+def test_token_bucket():
+    bucket = TokenBucket('test', rate=20, capacity=2)
+    assert bucket.acquire(0)
+    assert bucket.acquire(0)
+    # The bucket is empty and the next token takes 50 ms
+    assert not bucket.acquire(0.01)
+    assert bucket.acquire(0.1)
+    metrics = bucket.metrics()
+    assert metrics['acquired'] == 3
+    assert metrics['delayed'] == 1
+    assert metrics['rejected'] == 1
+
+
+def test_half_open_breaker_rate_limited():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+    bucket = TokenBucket('test', rate=1, capacity=1)
+    assert bucket.acquire(0)
+    breaker.record_failure()
+    time.sleep(0.06)
+    # The trial call is allowed but there is no token to make it with
+    assert breaker.allow()
+    assert not bucket.acquire(0)
+    breaker.release()
+    assert breaker.state == 'half-open'
+    # The trial can be made by the next caller
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+
+def test_fair_queue():
+    fq = FairQueue(max_per_key=2)
+    assert fq.put('alice', 1)
+    assert fq.put('alice', 2)
+    assert not fq.put('alice', 3)
+    assert fq.put('bob', 4)
+    assert len(fq) == 3
+    assert [fq.get() for _ in range(3)] == \
+        [('alice', 1), ('bob', 4), ('alice', 2)]
+    assert fq.metrics() == {'queued': 0, 'keys': 0, 'dropped': 1}
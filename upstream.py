@@ -0,0 +1,335 @@
+"""Tools for calling upstream services within a time budget."""
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+
+
+logger = logging.getLogger('indrabot.upstream')
+
+
+class UpstreamUnavailable(Exception):
+    pass
+
+
+class Deadline(object):
+    """A point in time by which some work has to be finished.
+
+    Parameters
+    ----------
+    timeout : Optional[float]
+        The number of seconds from now after which the deadline expires.
+        If None, the deadline never expires.
+    """
+    def __init__(self, timeout=None):
+        self.expires_at = None if timeout is None else \
+            time.monotonic() + timeout
+        self.cancelled = False
+
+    def cancel(self):
+        """Expire the deadline now, for instance, if the work it limits is
+        no longer needed."""
+        self.cancelled = True
+
+    def remaining(self):
+        """Return the number of seconds left, or None if unlimited."""
+        if self.cancelled:
+            return 0
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0)
+
+    def expired(self):
+        """Return True if the deadline has passed."""
+        return self.remaining() == 0
+
+    def timeout(self, limit=None):
+        """Return a timeout for a single call that respects the deadline.
+
+        Parameters
+        ----------
+        limit : Optional[float]
+            An upper bound on the timeout of the call itself.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return limit
+        if limit is None:
+            return remaining
+        return min(remaining, limit)
+
+
+class CircuitBreaker(object):
+    """Stop calling an upstream service while it is failing.
+
+    After failure_threshold consecutive failures the breaker opens and
+    allow() returns False so that callers go straight to their fallback.
+    Once reset_timeout seconds have passed, a single trial call is let
+    through, and its outcome decides whether the breaker closes again. If
+    an allowed call isn't made after all, release() has to be called.
+
+    Parameters
+    ----------
+    name : str
+        The name of the upstream service, used for logging.
+    failure_threshold : Optional[int]
+        The number of consecutive failures after which the breaker opens.
+        Default: 3
+    reset_timeout : Optional[float]
+        The number of seconds to wait before trying the service again.
+        Default: 30
+    """
+    def __init__(self, name, failure_threshold=3, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """Return True if a call to the upstream service should be made."""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def release(self):
+        """Give back a trial call that was allowed but not made."""
+        with self._lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info('Closing circuit breaker for %s' % self.name)
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or \
+                    self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning('Opening circuit breaker for %s after %d '
+                                   'failures' % (self.name, self.failures))
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class TTLCache(object):
+    """A thread-safe, size-bounded cache whose entries expire.
+
+    When the cache is full, the least recently used entry is evicted.
+
+    Parameters
+    ----------
+    maxsize : Optional[int]
+        The maximum number of entries in the cache. Default: 1000
+    ttl : Optional[float]
+        The number of seconds after which an entry expires. If None,
+        entries don't expire. Default: 3600
+    on_evict : Optional[callable]
+        A function called with the key and value of each entry that is
+        evicted, expires or is replaced, but not of entries that are
+        popped.
+    """
+    def __init__(self, maxsize=1000, ttl=3600, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+        if entry is not None:
+            self._evicted([(key, value)])
+        return default
+
+    def set(self, key, value):
+        expires_at = None if self.ttl is None else \
+            time.monotonic() + self.ttl
+        evicted = []
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] is not value:
+                evicted.append((key, entry[1]))
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                old_key, (_, old_value) = self._data.popitem(last=False)
+                evicted.append((old_key, old_value))
+        self._evicted(evicted)
+
+    def _evicted(self, entries):
+        if self.on_evict is not None:
+            for key, value in entries:
+                self.on_evict(key, value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and \
+                (entry[0] is None or entry[0] > time.monotonic())
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TokenBucket(object):
+    """Limit the rate of calls to an upstream service.
+
+    Tokens are added to the bucket at a constant rate up to its capacity,
+    and each call takes one token, so short bursts of up to capacity
+    calls are allowed.
+
+    Parameters
+    ----------
+    name : str
+        The name of the upstream service, used for logging.
+    rate : float
+        The number of calls allowed per second on average.
+    capacity : Optional[int]
+        The largest number of calls allowed in a burst. By default, the
+        rate rounded up.
+    """
+    def __init__(self, name, rate, capacity=None):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity if capacity else max(int(rate + 0.5), 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.acquired = 0
+        self.delayed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take a token, waiting for one if necessary.
+
+        Parameters
+        ----------
+        timeout : Optional[float]
+            The number of seconds we can wait for a token. If None, wait
+            as long as needed.
+
+        Returns
+        -------
+        bool
+            True if a token was taken, False if none would be available
+            within the timeout.
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        waited = False
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.acquired += 1
+                    if waited:
+                        self.delayed += 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+                if end is not None and end - time.monotonic() < wait:
+                    self.rejected += 1
+                    logger.info('Rate limit for %s reached' % self.name)
+                    return False
+            waited = True
+            time.sleep(wait)
+
+    def metrics(self):
+        with self._lock:
+            self._refill()
+            return {'tokens': round(self.tokens, 2),
+                    'acquired': self.acquired, 'delayed': self.delayed,
+                    'rejected': self.rejected}
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class FairQueue(object):
+    """A queue that takes turns between the items of different keys.
+
+    Items are put in the queue with a key, for instance, the user they
+    come from, and get() returns the items of different keys in a
+    round-robin order, so that no key can starve the others.
+
+    Parameters
+    ----------
+    max_per_key : Optional[int]
+        The maximum number of items queued for any one key. Default: 5
+    """
+    def __init__(self, max_per_key=5):
+        self.max_per_key = max_per_key
+        self.dropped = 0
+        self._queues = OrderedDict()
+        self._cond = threading.Condition()
+
+    def put(self, key, item):
+        """Add an item and return True, or False if the key's queue is full.
+        """
+        with self._cond:
+            key_queue = self._queues.setdefault(key, deque())
+            if len(key_queue) >= self.max_per_key:
+                self.dropped += 1
+                return False
+            key_queue.append(item)
+            self._cond.notify()
+            return True
+
+    def get(self):
+        """Return the next (key, item) tuple, waiting for one if needed."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._queues)
+            key, key_queue = self._queues.popitem(last=False)
+            item = key_queue.popleft()
+            # The key goes to the back of the line if it has more items
+            if key_queue:
+                self._queues[key] = key_queue
+            return key, item
+
+    def __len__(self):
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def metrics(self):
+        with self._cond:
+            return {'queued': sum(len(q) for q in self._queues.values()),
+                    'keys': len(self._queues), 'dropped': self.dropped}